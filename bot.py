@@ -1,9 +1,10 @@
 """Launches the bot"""
 
-from asyncio import run
+from asyncio import Event, run
 
 from aiogram import Bot, Dispatcher
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiohttp.web import AppRunner
 
 from tgbot.config import load_config, Config
 from tgbot.filters.admin import AdminFilter
@@ -15,7 +16,13 @@ from tgbot.middlewares.localization import i18n
 from tgbot.misc.commands import set_default_commands
 from tgbot.misc.logger import logger
 from tgbot.misc.scheduler import schedule
+from tgbot.misc.webhook import start_webhook, stop_webhook
 from tgbot.services.database import database
+from tgbot.services.fsm_storage import fsm_storage
+from tgbot.services.image import renderer
+from tgbot.services.media import media
+from tgbot.services.sharding import shard_leases
+from tgbot.services.weather import weather
 
 
 def register_all_middlewares(dp: Dispatcher) -> None:
@@ -41,7 +48,8 @@ async def main() -> None:
 
     config: Config = load_config()
     bot: Bot = Bot(token=config.tg_bot.token, parse_mode="HTML")
-    dp: Dispatcher = Dispatcher(bot=bot, storage=MemoryStorage())
+    # webhook requests may be balanced between several processes, so the dialog states are kept in the database
+    dp: Dispatcher = Dispatcher(bot=bot, storage=fsm_storage if config.webhook.enabled else MemoryStorage())
     bot["config"] = config
 
     register_all_middlewares(dp)
@@ -50,11 +58,26 @@ async def main() -> None:
 
     try:
         await database.init()
+        await media.load()
+        await weather.open(settings=config.http_client)
+        renderer.start(settings=config.render)
         await set_default_commands(dp)
         await schedule(dp)
-        await dp.skip_updates()
-        await dp.start_polling()
+        if config.webhook.enabled:
+            runner: AppRunner = await start_webhook(dp=dp, settings=config.webhook)
+            try:
+                await Event().wait()
+            finally:
+                await stop_webhook(runner=runner)
+        else:
+            await bot.delete_webhook()
+            await dp.skip_updates()
+            await dp.start_polling()
     finally:
+        await weather.close()
+        renderer.close()
+        await shard_leases.release()
+        await database.close()
         await dp.storage.close()
         await dp.storage.wait_closed()
         session = await bot.get_session()
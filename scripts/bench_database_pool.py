@@ -0,0 +1,81 @@
+"""
+Compares the pool of database connections with a connection per call,
+run from the root of the repository: python -m scripts.bench_database_pool
+"""
+
+from argparse import ArgumentParser, Namespace
+from asyncio import run
+from os.path import join
+from random import randint, seed
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from aiosqlite import Connection, connect
+
+from tgbot.services.database import Database
+
+
+def parse_args() -> Namespace:
+    """Parses command line arguments"""
+    parser: ArgumentParser = ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000, help="number of users in the database")
+    parser.add_argument("--iterations", type=int, default=300, help="number of settings reads and dialog_id writes")
+    return parser.parse_args()
+
+
+async def fill_database(database: Database, users: int) -> None:
+    """Adds users who have finished the dialog"""
+    for user_id in range(1, users + 1):
+        await database.save_dialog_id(user_id=user_id, dialog_id=user_id)
+        await database.save_city_coords(user_id=user_id, city="City", latitude=50.45, longitude=30.52)
+        await database.save_user_settings(user_id=user_id, lang_code="en", measure_units="metric")
+
+
+async def connect_per_call(path: str, users: int, iterations: int) -> float:
+    """Reads the settings and writes dialog_id of random users as before the pool, returns milliseconds per pair"""
+    started: float = perf_counter()
+    for _ in range(iterations):
+        user_id: int = randint(1, users)
+        db: Connection
+        async with connect(database=path) as db:
+            async with db.execute(
+                """SELECT lang, city, latitude, longitude, units FROM users WHERE id=?;""", (user_id,)
+            ) as cursor:
+                await cursor.fetchall()
+        async with connect(database=path) as db:
+            await db.execute("""UPDATE users SET dialog_id=? WHERE id=?;""", (user_id + 1, user_id))
+            await db.commit()
+    return (perf_counter() - started) / iterations * 1000
+
+
+async def pooled(database: Database, users: int, iterations: int) -> float:
+    """Reads the settings and writes dialog_id of random users through the pool, returns milliseconds per pair"""
+    started: float = perf_counter()
+    for _ in range(iterations):
+        user_id: int = randint(1, users)
+        await database.get_user_settings(user_id=user_id)
+        await database.save_dialog_id(user_id=user_id, dialog_id=user_id + 1)
+    return (perf_counter() - started) / iterations * 1000
+
+
+async def main() -> None:
+    """Runs the benchmark in a temporary database"""
+    args: Namespace = parse_args()
+    seed(0)
+    with TemporaryDirectory() as directory:
+        path: str = join(directory, "db.sqlite3")
+        database: Database = Database(path=path)
+        await database.init()
+        try:
+            await fill_database(database=database, users=args.users)
+            pool_ms: float = await pooled(database=database, users=args.users, iterations=args.iterations)
+            connect_ms: float = await connect_per_call(path=path, users=args.users, iterations=args.iterations)
+        finally:
+            await database.close()
+    print(f"{args.users} users, {args.iterations} pairs of a settings read and a dialog_id write")
+    print(f"connect per call: {connect_ms:.2f} ms per pair")
+    print(f"pooled + WAL:     {pool_ms:.2f} ms per pair")
+
+
+if __name__ == "__main__":
+    run(main())
@@ -0,0 +1,56 @@
+"""
+Measures how many forecast images are drawn per second on one core,
+run from the root of the repository: python -m scripts.bench_forecast_images
+"""
+
+from argparse import ArgumentParser, Namespace
+from array import array
+from random import choice, seed, uniform
+from time import perf_counter
+
+from tgbot.services.classes import ForecastData
+from tgbot.services.image import DrawWeatherImage
+
+ICON_CODES: tuple[str, ...] = tuple(
+    f"{code}{time}" for code in ("01", "02", "03", "04", "09", "10", "13") for time in "dn"
+)
+
+
+def parse_args() -> Namespace:
+    """Parses command line arguments"""
+    parser: ArgumentParser = ArgumentParser(description=__doc__)
+    parser.add_argument("--forecasts", type=int, default=40, help="number of distinct forecasts")
+    parser.add_argument("--rounds", type=int, default=5, help="how many times every forecast is drawn")
+    return parser.parse_args()
+
+
+def make_forecast() -> ForecastData:
+    """Creates a random forecast for the next 24 hours with the step of 3 hours, as OpenWeatherMap returns it"""
+    return ForecastData(
+        time=[f"{hour:02}:00" for hour in range(0, 24, 3)],
+        ico_code=[choice(ICON_CODES) for _ in range(8)],
+        temp=array("f", (round(uniform(-30, 40)) for _ in range(8))),
+        wind_speed=array("f", (round(uniform(0, 20)) for _ in range(8))),
+    )
+
+
+def main() -> None:
+    """Draws every forecast in both units several times and prints the rate"""
+    args: Namespace = parse_args()
+    seed(0)
+    forecasts: list[ForecastData] = [make_forecast() for _ in range(args.forecasts)]
+    drawer: DrawWeatherImage = DrawWeatherImage()
+    drawer.draw_image(data=forecasts[0], units="metric")  # fonts and icons are loaded by the first image
+    images: int = 0
+    started: float = perf_counter()
+    for _ in range(args.rounds):
+        for forecast in forecasts:
+            for units in ("metric", "imperial"):
+                drawer.draw_image(data=forecast, units=units)
+                images += 1
+    elapsed: float = perf_counter() - started
+    print(f"{images} images of {args.forecasts} forecasts in {elapsed:.2f} s: {images / elapsed:.1f} images/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Measures the offline city index and checks it by brute force,
+run from the root of the repository: python -m scripts.bench_offline_geocoder
+"""
+
+from argparse import ArgumentParser, Namespace
+from math import asin, cos, radians, sin, sqrt
+from os.path import join
+from random import gauss, random, seed, uniform
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from tgbot.services.classes import CityData
+from tgbot.services.geoindex import CityIndex
+
+EARTH_RADIUS_KM: float = 6371.0
+MAX_DISTANCE_KM: float = 300.0  # the same as in the index
+
+
+def parse_args() -> Namespace:
+    """Parses command line arguments"""
+    parser: ArgumentParser = ArgumentParser(description=__doc__)
+    parser.add_argument("--geonames", default="", help="GeoNames dump, a synthetic one is generated if not set")
+    parser.add_argument("--cities", type=int, default=200000, help="number of cities in the synthetic dump")
+    parser.add_argument("--queries", type=int, default=2000, help="number of timed queries")
+    parser.add_argument("--checks", type=int, default=200, help="number of queries checked by brute force")
+    return parser.parse_args()
+
+
+def write_synthetic_dump(path: str, cities: int) -> None:
+    """Writes cities crowded around Europe and scattered over the globe in the format of GeoNames"""
+    with open(path, mode="w", encoding="utf-8") as file:
+        for geoname_id in range(cities):
+            if random() < 0.7:
+                latitude, longitude = gauss(50, 8), gauss(20, 15)
+            else:
+                latitude, longitude = uniform(-90, 90), uniform(-180, 180)
+            latitude, longitude = max(-89.99, min(89.99, latitude)), (longitude + 180) % 360 - 180
+            file.write(f"{geoname_id}\tCity {geoname_id}\t\t\t{latitude:.5f}\t{longitude:.5f}\tP\tPPL\tXX\n")
+
+
+def read_cities(path: str) -> list[tuple[str, float, float]]:
+    """Reads the name and coordinates of every city for the brute-force search"""
+    cities: list[tuple[str, float, float]] = []
+    with open(path, mode="r", encoding="utf-8") as file:
+        for line in file:
+            fields: list[str] = line.split("\t")
+            if len(fields) >= 9:
+                cities.append((fields[1], float(fields[4]), float(fields[5])))
+    return cities
+
+
+def get_distance(lat_1: float, lon_1: float, lat_2: float, lon_2: float) -> float:
+    """Returns the great-circle distance in kilometers"""
+    hav: float = (
+        sin(radians(lat_2 - lat_1) / 2) ** 2
+        + cos(radians(lat_1)) * cos(radians(lat_2)) * sin(radians(lon_2 - lon_1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(min(1.0, hav)))
+
+
+def find_nearest(cities: list[tuple[str, float, float]], latitude: float, longitude: float) -> list[str]:
+    """Returns the names of up to 5 nearest cities within the maximum distance by checking every city"""
+    distances: list[tuple[float, str]] = sorted(
+        (get_distance(latitude, longitude, city_lat, city_lon), name) for name, city_lat, city_lon in cities
+    )
+    return [name for distance, name in distances[:5] if distance <= MAX_DISTANCE_KM]
+
+
+def run_benchmark(path: str, args: Namespace) -> None:
+    """Loads the index, times random queries and compares some of them with the brute-force search"""
+    started: float = perf_counter()
+    index: CityIndex = CityIndex.from_geonames(path=path)
+    print(f"load: {len(index)} cities in {perf_counter() - started:.2f} s")
+    points: list[tuple[float, float]] = [(uniform(-90, 90), uniform(-180, 180)) for _ in range(args.queries)]
+    started = perf_counter()
+    for latitude, longitude in points:
+        index.find_nearest(latitude=latitude, longitude=longitude)
+    print(f"query: {(perf_counter() - started) / args.queries * 1e6:.0f} us per nearest-5 lookup")
+    cities: list[tuple[str, float, float]] = read_cities(path=path)
+    matches: int = 0
+    for latitude, longitude in points[: args.checks]:
+        found: list[CityData] | None = index.find_nearest(latitude=latitude, longitude=longitude)
+        matches += [city.name for city in found or []] == find_nearest(
+            cities=cities, latitude=latitude, longitude=longitude
+        )
+    print(f"nearest 5 cities match brute force in {matches} of {min(args.checks, args.queries)} random points")
+
+
+def main() -> None:
+    """Runs the benchmark with the specified or a synthetic dump"""
+    args: Namespace = parse_args()
+    seed(0)
+    if args.geonames:
+        run_benchmark(path=args.geonames, args=args)
+        return
+    with TemporaryDirectory() as directory:
+        path: str = join(directory, "cities.txt")
+        write_synthetic_dump(path=path, cities=args.cities)
+        run_benchmark(path=path, args=args)
+
+
+if __name__ == "__main__":
+    main()
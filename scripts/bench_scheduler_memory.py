@@ -0,0 +1,125 @@
+"""
+Measures peak memory and time of scheduled update runs with many users,
+run from the root of the repository: python -m scripts.bench_scheduler_memory
+"""
+
+from argparse import ArgumentParser, Namespace
+from asyncio import run
+from os import remove
+from os.path import exists
+from random import choice, seed, uniform
+from resource import RUSAGE_SELF, getrusage
+from sqlite3 import connect
+from time import perf_counter
+from typing import AsyncIterator, Iterator
+
+from aiogram import Bot, Dispatcher
+
+from tgbot.config import DB_FILE, QuotaSettings, ScheduleSettings, load_config
+from tgbot.misc import scheduler
+from tgbot.services.broadcast_store import broadcast_store
+from tgbot.services.classes import SlotRange, User
+from tgbot.services.database import database, get_location_hash
+from tgbot.services.quota import QuotaGovernor
+from tgbot.services.sharding import shard_leases
+
+TIME_ZONES: tuple[int, ...] = tuple(range(-36000, 50401, 3600))
+loaded_users: list[int] = [0, 0]  # number of read users and the largest batch
+
+
+def parse_args() -> Namespace:
+    """Parses command line arguments"""
+    parser: ArgumentParser = ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000000, help="number of users in the database")
+    parser.add_argument("--cities", type=int, default=50000, help="number of distinct locations")
+    parser.add_argument("--runs", type=int, default=3, help="number of scheduled update runs")
+    return parser.parse_args()
+
+
+def generate_users(users: int, cities: int) -> Iterator[tuple]:
+    """Yields rows of users in random cities, 5% of them have not finished the dialog"""
+    locations: list[tuple[float, float]] = [(uniform(-60, 70), uniform(-180, 180)) for _ in range(cities)]
+    for user_id in range(1, users + 1):
+        latitude, longitude = choice(locations)
+        subscribed: bool = user_id % 20 != 0
+        yield (
+            user_id,
+            user_id,
+            "en" if subscribed else None,
+            "City",
+            latitude,
+            longitude,
+            choice(("metric", "imperial")) if subscribed else None,
+            choice(TIME_ZONES) if user_id % 3 else None,
+            get_location_hash(latitude=latitude, longitude=longitude),
+        )
+
+
+async def count_due_users(dp: Dispatcher, batches: AsyncIterator[list[User]], precision: int | None) -> None:
+    """Replaces the weather update, the batches of users are only read and counted"""
+    del dp, precision
+    async for users in batches:
+        loaded_users[0] += len(users)
+        loaded_users[1] = max(loaded_users[1], len(users))
+
+
+async def benchmark(args: Namespace) -> None:
+    """
+    Fills the database, adds the updates of all users to the broadcast queue as if the whole update interval has passed
+    and runs scheduled updates with the weather update stubbed out, each run reads all users in batches
+    """
+    await database.init()
+    with connect(DB_FILE) as db:
+        db.executemany(
+            """INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);""", generate_users(args.users, args.cities)
+        )
+    scheduler.update_weather_data = count_due_users
+    bot: Bot = Bot(token="1:test")
+    settings: ScheduleSettings = load_config().schedule
+    updates: scheduler.StaggeredUpdates = scheduler.StaggeredUpdates(
+        dp=Dispatcher(bot=bot),
+        governor=QuotaGovernor(settings=QuotaSettings(monthly_limit=10**12, interactive_reserve=0.1)),
+        settings=settings,
+    )
+    started: float = perf_counter()
+    await updates.run()  # leases the shards and makes the refresh plan
+    print(f"first run with the refresh plan: {perf_counter() - started:.2f} s")
+    await broadcast_store.enqueue_due_users(
+        slot_ranges=[SlotRange(start=0, end=scheduler.LOCATION_HASHES, aligned=False, utc_offset=None)],
+        shards=list(range(settings.shards)),
+        total_shards=settings.shards,
+    )
+    loaded_users[:] = [0, 0]
+    baseline: int = getrusage(RUSAGE_SELF).ru_maxrss
+    started = perf_counter()
+    for _ in range(args.runs):
+        await updates.run()
+    elapsed: float = (perf_counter() - started) / args.runs
+    peak: int = getrusage(RUSAGE_SELF).ru_maxrss
+    print(
+        f"{await database.get_number_of_users()} users, {loaded_users[0] // args.runs} of them due: "
+        f"{elapsed:.2f} s per run, batches of up to {loaded_users[1]} users"
+    )
+    print(f"peak RSS {peak / 1024:.0f} MB, +{(peak - baseline) / 1024:.0f} MB while the due users were read")
+    await shard_leases.release()
+    await database.close()
+    session = await bot.get_session()
+    await session.close()
+
+
+def main() -> None:
+    """Runs the benchmark in the database file of the bot, which must not exist"""
+    args: Namespace = parse_args()
+    if exists(DB_FILE):
+        raise SystemExit(f"{DB_FILE} already exists, move it away before running the benchmark")
+    seed(0)
+    try:
+        run(benchmark(args=args))
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if exists(DB_FILE + suffix):
+                remove(DB_FILE + suffix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Measures the throughput of the webhook with a fake Bot API server,
+run from the root of the repository: python -m scripts.webhook_load_test
+"""
+
+from argparse import ArgumentParser, Namespace
+from asyncio import Task, gather, run, sleep
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from aiogram import Bot, Dispatcher
+from aiogram.bot.api import TelegramAPIServer
+from aiohttp import ClientSession, web
+
+from tgbot.config import WebhookSettings
+from tgbot.handlers.dialog import register_dialog_handlers
+from tgbot.middlewares.localization import i18n
+from tgbot.misc.webhook import SECRET_TOKEN_HEADER, UPDATE_TASKS_KEY, start_webhook, stop_webhook
+from tgbot.services.database import Database
+from tgbot.services.fsm_storage import DatabaseStorage
+
+
+HOST: str = "127.0.0.1"
+WEBHOOK_PORT: int = 8080
+API_PORT: int = 8081
+SECRET_TOKEN: str = "load-test"
+
+
+def parse_args() -> Namespace:
+    """Parses command line arguments"""
+    parser: ArgumentParser = ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=2000, help="number of updates posted at once")
+    parser.add_argument("--concurrency", type=int, default=32, help="maximum number of updates processed at once")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="delay of each Bot API call, s")
+    return parser.parse_args()
+
+
+def make_update(update_id: int) -> dict:
+    """Creates a text message update from a new user"""
+    user: dict = {"id": update_id, "is_bot": False, "first_name": "User", "language_code": "en"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": update_id, "type": "private"},
+            "from": user,
+            "text": "hello",
+        },
+    }
+
+
+async def start_fake_api(latency: float) -> web.AppRunner:
+    """Starts a server that answers every Bot API call successfully after the delay"""
+
+    async def answer(_: web.Request) -> web.Response:
+        await sleep(latency)
+        return web.json_response({"ok": True, "result": True})
+
+    app: web.Application = web.Application()
+    app.router.add_route(method="POST", path="/{method:.*}", handler=answer)
+    runner: web.AppRunner = web.AppRunner(app=app)
+    await runner.setup()
+    await web.TCPSite(runner=runner, host=HOST, port=API_PORT).start()
+    return runner
+
+
+async def post_updates(url: str, updates: int) -> None:
+    """Posts the updates at once and prints the throughput and latencies of the answers of the webhook"""
+    latencies: list[float] = []
+    async with ClientSession() as session:
+        async with session.post(url, json=make_update(0)) as response:
+            print(f"Request without the secret token: HTTP {response.status}")
+
+        async def post(update_id: int) -> None:
+            started: float = perf_counter()
+            async with session.post(
+                url, json=make_update(update_id), headers={SECRET_TOKEN_HEADER: SECRET_TOKEN}
+            ) as response:
+                response.raise_for_status()
+            latencies.append(perf_counter() - started)
+
+        started: float = perf_counter()
+        await gather(*(post(update_id) for update_id in range(1, updates + 1)))
+        elapsed: float = perf_counter() - started
+    latencies.sort()
+    print(
+        f"{updates} updates accepted in {elapsed:.2f} s: {updates / elapsed:.0f} updates/s, "
+        f"p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.0f} ms"
+    )
+
+
+async def wait_for_updates(runner: web.AppRunner, started: float) -> None:
+    """Waits until the webhook has processed all accepted updates and prints the time"""
+    tasks: set[Task] = runner.app[UPDATE_TASKS_KEY]
+    while tasks:
+        await sleep(0.01)
+    print(f"All updates processed in {perf_counter() - started:.2f} s")
+
+
+async def run_load_test(args: Namespace, storage: DatabaseStorage) -> None:
+    """Starts the webhook and the fake Bot API server, posts the updates and waits until they are processed"""
+    api_runner: web.AppRunner = await start_fake_api(latency=args.api_latency)
+    bot: Bot = Bot(token="1:test", server=TelegramAPIServer.from_base(f"http://{HOST}:{API_PORT}"))
+    dp: Dispatcher = Dispatcher(bot=bot, storage=storage)
+    dp.middleware.setup(i18n)
+    register_dialog_handlers(dp)
+    settings: WebhookSettings = WebhookSettings(
+        enabled=True,
+        url="https://example.com/webhook",
+        host=HOST,
+        port=WEBHOOK_PORT,
+        path="/webhook",
+        secret_token=SECRET_TOKEN,
+        max_concurrent_updates=args.concurrency,
+    )
+    runner: web.AppRunner = await start_webhook(dp=dp, settings=settings)
+    try:
+        started: float = perf_counter()
+        await post_updates(url=f"http://{HOST}:{WEBHOOK_PORT}{settings.path}", updates=args.updates)
+        await wait_for_updates(runner=runner, started=started)
+    finally:
+        await stop_webhook(runner=runner)
+        await api_runner.cleanup()
+        session = await bot.get_session()
+        await session.close()
+
+
+async def main() -> None:
+    """Runs the load test with the dialog states in a temporary database, as in webhook mode"""
+    args: Namespace = parse_args()
+    with TemporaryDirectory() as directory:
+        database: Database = Database(path=join(directory, "db.sqlite3"))
+        await database.init()
+        try:
+            await run_load_test(args=args, storage=DatabaseStorage(db=database))
+        finally:
+            await database.close()
+
+
+if __name__ == "__main__":
+    run(main())
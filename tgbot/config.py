@@ -1,5 +1,6 @@
 """Configuration settings for the bot"""
 
+from os import cpu_count
 from os.path import join, normpath
 from pathlib import Path
 from typing import NamedTuple
@@ -27,11 +28,113 @@ class WeatherToken(NamedTuple):
     token: str
 
 
+class HttpClientSettings(NamedTuple):
+    """Settings of the pooled HTTP client for requests to OpenWeatherMap"""
+
+    limit_per_host: int
+    keepalive_timeout: float
+    dns_cache_ttl: int
+    connect_timeout: float
+    total_timeout: float  # seconds, for each attempt of the request
+    retries: int
+    retry_delay: float  # seconds, the delay before each next retry is doubled and randomised
+    breaker_threshold: int  # failed requests in a row after which requests to the endpoint are stopped
+    breaker_reset_timeout: float  # seconds between trial requests to the unavailable endpoint
+
+
+class WeatherCacheSettings(NamedTuple):
+    """Settings of the cache of the last successfully obtained weather of locations"""
+
+    size: int
+    max_age: int  # seconds during which the weather can be shown if OpenWeatherMap is unavailable
+
+
+class BroadcastSettings(NamedTuple):
+    """Settings of the scheduled weather broadcast"""
+
+    workers: int
+    rate_limit: float
+    chat_interval: float
+    queue_size: int
+    edit_messages: bool  # replace the previous dialog message instead of sending a new one and deleting the old
+
+
+class RenderSettings(NamedTuple):
+    """Settings of the executor that draws weather forecast images"""
+
+    executor: str  # "thread" or "process"
+    workers: int
+    max_in_flight: int
+
+
+class GeocodingCacheSettings(NamedTuple):
+    """Settings of the cache of city search results"""
+
+    size: int
+    memory_ttl: int
+    database_ttl: int
+
+
+class CoalescingSettings(NamedTuple):
+    """Settings of the sharing of identical requests to OpenWeatherMap"""
+
+    reuse_window: float  # seconds during which a successful response is reused, 0 to only share requests in flight
+    size: int
+
+
+class OfflineGeocodingSettings(NamedTuple):
+    """Settings of the search for the nearest city without requests to OpenWeatherMap"""
+
+    geonames_file: str  # path to a GeoNames cities dump, empty string to disable
+    alternate_names_file: str  # path to a GeoNames alternate names dump with the names in the bot languages
+    fallback_to_api: bool
+
+
+class QuotaSettings(NamedTuple):
+    """Settings of the OpenWeatherMap request budget"""
+
+    monthly_limit: int
+    interactive_reserve: float  # share of the monthly limit kept for requests of users in the dialog
+
+
+class ScheduleSettings(NamedTuple):
+    """Settings of the spreading of scheduled weather updates over time"""
+
+    slice_interval: int  # seconds between batches of users
+    align_to_morning: bool
+    morning_hour: int  # local time of the user's city
+    location_workers: int  # locations whose weather is requested and drawn at the same time
+    shards: int  # parts into which users are divided between bot processes, must be the same in all of them
+    lease_ttl: int  # seconds after which shards of a stopped process are taken over by others
+
+
+class WebhookSettings(NamedTuple):
+    """Settings of receiving updates by webhook instead of long polling"""
+
+    enabled: bool
+    url: str  # public URL to which Telegram sends updates
+    host: str
+    port: int
+    path: str
+    secret_token: str  # required in webhook mode, requests without it in the header are rejected
+    max_concurrent_updates: int
+
+
 class Config(NamedTuple):
     """Bot config"""
 
     tg_bot: TgBot
     weather_api: WeatherToken
+    http_client: HttpClientSettings
+    broadcast: BroadcastSettings
+    render: RenderSettings
+    geocoding_cache: GeocodingCacheSettings
+    coalescing: CoalescingSettings
+    weather_cache: WeatherCacheSettings
+    offline_geocoding: OfflineGeocodingSettings
+    quota: QuotaSettings
+    schedule: ScheduleSettings
+    webhook: WebhookSettings
 
 
 def load_config() -> Config:
@@ -41,4 +144,66 @@ def load_config() -> Config:
     return Config(
         tg_bot=TgBot(token=env.str("BOT_TOKEN"), admin_ids=tuple(map(int, env.list("ADMINS")))),
         weather_api=WeatherToken(token=env.str("WEATHER_API_TOKEN")),
+        http_client=HttpClientSettings(
+            limit_per_host=env.int("HTTP_LIMIT_PER_HOST", 20),
+            keepalive_timeout=env.float("HTTP_KEEPALIVE_TIMEOUT", 60.0),
+            dns_cache_ttl=env.int("HTTP_DNS_CACHE_TTL", 300),
+            connect_timeout=env.float("HTTP_CONNECT_TIMEOUT", 5.0),
+            total_timeout=env.float("HTTP_TOTAL_TIMEOUT", 15.0),
+            retries=env.int("HTTP_RETRIES", 2),
+            retry_delay=env.float("HTTP_RETRY_DELAY", 0.5),
+            breaker_threshold=env.int("HTTP_BREAKER_THRESHOLD", 5),
+            breaker_reset_timeout=env.float("HTTP_BREAKER_RESET_TIMEOUT", 30.0),
+        ),
+        broadcast=BroadcastSettings(
+            workers=env.int("BROADCAST_WORKERS", 8),
+            rate_limit=env.float("BROADCAST_RATE_LIMIT", 25.0),
+            chat_interval=env.float("BROADCAST_CHAT_INTERVAL", 1.0),
+            queue_size=env.int("BROADCAST_QUEUE_SIZE", 100),
+            edit_messages=env.bool("BROADCAST_EDIT_MESSAGES", True),
+        ),
+        render=RenderSettings(
+            executor=env.str("RENDER_EXECUTOR", "thread", validate=lambda value: value in ("thread", "process")),
+            workers=env.int("RENDER_WORKERS", cpu_count() or 1),
+            max_in_flight=env.int("RENDER_MAX_IN_FLIGHT", 2 * (cpu_count() or 1)),
+        ),
+        geocoding_cache=GeocodingCacheSettings(
+            size=env.int("GEOCODING_CACHE_SIZE", 4096),
+            memory_ttl=env.int("GEOCODING_CACHE_MEMORY_TTL", 86400),
+            database_ttl=env.int("GEOCODING_CACHE_DATABASE_TTL", 2592000),
+        ),
+        coalescing=CoalescingSettings(
+            reuse_window=env.float("API_REUSE_WINDOW", 30.0),
+            size=env.int("API_REUSE_SIZE", 1024),
+        ),
+        weather_cache=WeatherCacheSettings(
+            size=env.int("WEATHER_CACHE_SIZE", 4096),
+            max_age=env.int("WEATHER_CACHE_MAX_AGE", 21600),
+        ),
+        offline_geocoding=OfflineGeocodingSettings(
+            geonames_file=env.str("GEONAMES_FILE", ""),
+            alternate_names_file=env.str("GEONAMES_ALTERNATE_NAMES_FILE", ""),
+            fallback_to_api=env.bool("OFFLINE_GEOCODING_FALLBACK_TO_API", True),
+        ),
+        quota=QuotaSettings(
+            monthly_limit=env.int("QUOTA_MONTHLY_LIMIT", 1000000),
+            interactive_reserve=env.float("QUOTA_INTERACTIVE_RESERVE", 0.1),
+        ),
+        schedule=ScheduleSettings(
+            slice_interval=env.int("SCHEDULE_SLICE_INTERVAL", 60),
+            align_to_morning=env.bool("SCHEDULE_ALIGN_TO_MORNING", False),
+            morning_hour=env.int("SCHEDULE_MORNING_HOUR", 7, validate=lambda value: 0 <= value < 24),
+            location_workers=env.int("SCHEDULE_LOCATION_WORKERS", 8),
+            shards=env.int("SCHEDULE_SHARDS", 16),
+            lease_ttl=env.int("SCHEDULE_LEASE_TTL", 180),
+        ),
+        webhook=WebhookSettings(
+            enabled=env.bool("WEBHOOK_ENABLED", False),
+            url=env.str("WEBHOOK_URL", ""),
+            host=env.str("WEBHOOK_HOST", "127.0.0.1"),
+            port=env.int("WEBHOOK_PORT", 8080),
+            path=env.str("WEBHOOK_PATH", "/webhook"),
+            secret_token=env.str("WEBHOOK_SECRET_TOKEN", ""),
+            max_concurrent_updates=env.int("WEBHOOK_MAX_CONCURRENT_UPDATES", 32),
+        ),
     )
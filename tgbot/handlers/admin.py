@@ -3,11 +3,12 @@
 from asyncio import sleep
 
 from aiogram import Dispatcher
-from aiogram.types import InputFile, Message
+from aiogram.types import Message
 
-from tgbot.config import BOT_LOGO
+from tgbot.config import BOT_LOGO, Config
 from tgbot.middlewares.localization import i18n
 from tgbot.services.database import database
+from tgbot.services.media import media
 
 
 _ = i18n.gettext  # Alias for gettext method
@@ -17,6 +18,8 @@ async def if_admin_sent_command_stats(message: Message) -> None:
     """Shows statistics for administrators"""
     await message.delete()
     user_lang_code: str = message.from_user.language_code
+    config: Config = message.bot.get("config")
+    monthly_limit: int = config.quota.monthly_limit
     api_counter: int = await database.get_api_counter_value()
     users_counter: int = await database.get_number_of_users()
     bot_answer_text: str = (
@@ -24,18 +27,20 @@ async def if_admin_sent_command_stats(message: Message) -> None:
         + _("Statistics", locale=user_lang_code)
         + ":</b>\n\n• "
         + _("Since beginning of the month", locale=user_lang_code)
-        + f",\n  <b>{round((api_counter / 1000000) * 100)} %</b>"
+        + f",\n  <b>{round((api_counter / monthly_limit) * 100)} %</b>"
         + _("requests have been spent", locale=user_lang_code)
         + ":\n  <b>"
         + f"{api_counter:_}".replace("_", " ")
         + "</b> "
         + _("out of", locale=user_lang_code)
-        + " <b>1 000 000</b>\n\n• "
+        + " <b>"
+        + f"{monthly_limit:_}".replace("_", " ")
+        + "</b>\n\n• "
         + _("Users in the database", locale=user_lang_code)
         + f": <b>{users_counter}</b>"
     )
-    bot_answer: Message = await message.answer_photo(
-        photo=InputFile(BOT_LOGO), caption=bot_answer_text, reply_markup=None
+    bot_answer: Message = await media.send_photo(
+        bot=message.bot, chat_id=message.chat.id, path=BOT_LOGO, caption=bot_answer_text, reply_markup=None
     )
     await sleep(15)
     await message.bot.delete_message(chat_id=bot_answer.chat.id, message_id=bot_answer.message_id)
@@ -1,11 +1,10 @@
 """ Handling messages from bot users """
 
 from asyncio import sleep
-from os import remove as os_remove
 
 from aiogram import Dispatcher
 from aiogram.dispatcher import FSMContext
-from aiogram.types import CallbackQuery, ContentTypes, InlineKeyboardMarkup, InputFile, Message, ReplyKeyboardMarkup
+from aiogram.types import CallbackQuery, ContentTypes, InlineKeyboardMarkup, Message, ReplyKeyboardMarkup
 from aiogram.utils.exceptions import MessageToDeleteNotFound
 
 from tgbot.config import BOT_LOGO
@@ -14,7 +13,8 @@ from tgbot.keyboards.reply import create_geolocation_kb
 from tgbot.middlewares.localization import i18n
 from tgbot.misc.states import WeatherSetupDialog
 from tgbot.services.database import database
-from tgbot.services.classes import CityData
+from tgbot.services.media import media
+from tgbot.services.classes import CityData, WeatherSnapshot
 from tgbot.services.weather import weather
 
 
@@ -49,8 +49,10 @@ async def dialog_start(message: Message, state: FSMContext) -> None:
         + _("Write the name of the city or send your coordinates", locale=user_lang_code)
         + ":"
     )
-    dialog: Message = await message.answer_photo(
-        photo=InputFile(BOT_LOGO),
+    dialog: Message = await media.send_photo(
+        bot=message.bot,
+        chat_id=message.chat.id,
+        path=BOT_LOGO,
         caption=dialog_text,
         disable_notification=True,
         reply_markup=await create_geolocation_kb(lang_code=user_lang_code),
@@ -86,8 +88,13 @@ async def dialog_select_city(message: Message) -> None:
         )
         reply_markup = await create_geolocation_kb(lang_code=user_lang_code)
         await WeatherSetupDialog.EnterCityName.set()  # Unblock user input for another city name
-    dialog: Message = await message.answer_photo(
-        photo=InputFile(BOT_LOGO), caption=dialog_text, disable_notification=True, reply_markup=reply_markup
+    dialog: Message = await media.send_photo(
+        bot=message.bot,
+        chat_id=message.chat.id,
+        path=BOT_LOGO,
+        caption=dialog_text,
+        disable_notification=True,
+        reply_markup=reply_markup,
     )
     await database.save_dialog_id(user_id=user_id, dialog_id=dialog.message_id)
 
@@ -97,8 +104,10 @@ async def dialog_select_another_city(call: CallbackQuery) -> None:
     user_lang_code: str = call.from_user.language_code
     user_id: int = call.from_user.id
     await delete_previous_dialog_message(obj=call)
-    dialog: Message = await call.message.answer_photo(
-        photo=InputFile(BOT_LOGO),
+    dialog: Message = await media.send_photo(
+        bot=call.bot,
+        chat_id=call.message.chat.id,
+        path=BOT_LOGO,
         caption=_("Write the name of the city or send your coordinates", locale=user_lang_code) + ":",
         disable_notification=True,
         reply_markup=await create_geolocation_kb(lang_code=user_lang_code),
@@ -112,8 +121,10 @@ async def dialog_select_measure_units(call: CallbackQuery) -> None:
     user_lang_code: str = call.from_user.language_code
     user_id: int = call.from_user.id
     await delete_previous_dialog_message(obj=call)
-    dialog: Message = await call.message.answer_photo(
-        photo=InputFile(BOT_LOGO),
+    dialog: Message = await media.send_photo(
+        bot=call.bot,
+        chat_id=call.message.chat.id,
+        path=BOT_LOGO,
         caption="🌡 " + _("Choose units of temperature measurement", locale=user_lang_code) + ":",
         disable_notification=True,
         reply_markup=await create_units_selection_kb(),
@@ -130,20 +141,20 @@ async def dialog_finish(call: CallbackQuery, state: FSMContext) -> None:
     await delete_previous_dialog_message(obj=call)
     measure_units: str = "metric" if call.data.removeprefix("units=") == "c" else "imperial"
     await database.save_user_settings(user_id=user_id, lang_code=user_lang_code, measure_units=measure_units)
-    weather_forecast: str = await weather.get_weather_forecast(user_id=user_id)
-    dialog: Message = await call.message.answer_photo(
-        photo=InputFile(weather_forecast),
-        caption=await weather.get_current_weather(user_id=user_id),
+    weather_snapshot: WeatherSnapshot = await weather.get_weather_snapshot(user_id=user_id)
+    dialog: Message = await media.send_forecast(
+        bot=call.bot,
+        chat_id=call.message.chat.id,
+        forecast_image=weather_snapshot.image,
+        caption=weather_snapshot.caption,
         disable_notification=True,
     )
-    if weather_forecast[-12:-4] != "bot_logo":
-        os_remove(weather_forecast)
     await database.save_dialog_id(user_id=user_id, dialog_id=dialog.message_id)
     final_message_text: str = (
         "🌥 "
         + _("The weather setup is complete", locale=user_lang_code)
         + "\n\n"
-        + _("The data will be updated automatically every 3 hours", locale=user_lang_code)
+        + _("The data will be updated automatically", locale=user_lang_code)
     )
     final_message: Message = await call.message.answer(
         text=f"<code>{final_message_text}</code>", disable_notification=True
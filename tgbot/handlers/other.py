@@ -4,12 +4,13 @@ from asyncio import sleep
 
 from aiogram import Dispatcher
 from aiogram.dispatcher import FSMContext
-from aiogram.types import InputFile, Message
+from aiogram.types import Message
 
 from tgbot.config import BOT_LOGO
 from tgbot.handlers.dialog import delete_previous_dialog_message
 from tgbot.middlewares.localization import i18n
 from tgbot.services.database import database
+from tgbot.services.media import media
 
 _ = i18n.gettext  # Alias for gettext method
 
@@ -35,8 +36,8 @@ async def if_user_sent_command_about(message: Message) -> None:
         + _("The source code is available on", locale=user_lang_code)
         + ' <a href="https://github.com/rin-gil/OpenWeatherBot">GitHub</a>'
     )
-    bot_answer: Message = await message.answer_photo(
-        photo=InputFile(BOT_LOGO), caption=bot_answer_text, reply_markup=None
+    bot_answer: Message = await media.send_photo(
+        bot=message.bot, chat_id=message.chat.id, path=BOT_LOGO, caption=bot_answer_text, reply_markup=None
     )
     await sleep(15)
     await message.bot.delete_message(chat_id=bot_answer.chat.id, message_id=bot_answer.message_id)
@@ -49,8 +50,8 @@ async def if_user_sent_command_stop(message: Message, state: FSMContext) -> None
     await state.reset_state()
     await database.delete_user(user_id=message.from_user.id)
     bot_answer_text: str = "❌ " + _("All of your data has been deleted", locale=user_lang_code)
-    bot_answer: Message = await message.answer_photo(
-        photo=InputFile(BOT_LOGO), caption=bot_answer_text, reply_markup=None
+    bot_answer: Message = await media.send_photo(
+        bot=message.bot, chat_id=message.chat.id, path=BOT_LOGO, caption=bot_answer_text, reply_markup=None
     )
     await sleep(5)
     await message.bot.delete_message(chat_id=bot_answer.chat.id, message_id=bot_answer.message_id)
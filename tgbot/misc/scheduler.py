@@ -1,47 +1,223 @@
 """ Functions for sending scheduled weather data """
 
-from asyncio import sleep
-from os import remove as os_remove
+from asyncio import Queue, gather
+from datetime import datetime
+from time import time
+from typing import AsyncIterator
 
 from aiogram import Dispatcher
-from aiogram.types import InputFile, Message
-from aiogram.utils.exceptions import BotBlocked, RetryAfter, UserDeactivated
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+from tgbot.config import Config, ScheduleSettings
+from tgbot.misc.logger import logger
+from tgbot.services.broadcast import Broadcaster
+from tgbot.services.broadcast_store import broadcast_store
+from tgbot.services.classes import BroadcastJob, ForecastImage, LocationWeather, RefreshPlan, SlotRange
 from tgbot.services.database import database, User
+from tgbot.services.media import ForecastImageCache
+from tgbot.services.quota import get_location_key, LocationKey, QuotaGovernor
+from tgbot.services.sharding import shard_leases
 from tgbot.services.weather import weather
 
 
-async def update_weather_data(dp: Dispatcher) -> None:
-    """Updates weather data for all users"""
-    users: list[User] = await database.get_list_all_users()
+API_COUNTER_FLUSH_INTERVAL: int = 60  # seconds
+STATS_LOG_INTERVAL: int = 3600  # seconds
+PLANNING_WINDOW: int = 3 * 3600  # seconds, the refresh plan is revised at the beginning of every window
+MORNING_SPREAD: int = 3600  # seconds, morning updates of different locations are spread over this time
+LOCATION_HASHES: int = 2**32  # location hashes are crc32 values
+
+
+def get_hash_ranges(start: float, length: float, period: int, span: int) -> list[tuple[float, float]]:
+    """
+    Returns the ranges of location hashes whose time falls within [start, start + length) of a repeating period,
+    the time of a hash is hash / LOCATION_HASHES of the span from the beginning of the period
+    """
+    start %= period
+    pieces: list[tuple[float, float]] = [(start, min(start + length, period))]
+    if start + length > period:
+        pieces.append((0.0, start + length - period))
+    return [
+        (begin * LOCATION_HASHES / span, min(end, span) * LOCATION_HASHES / span)
+        for begin, end in pieces
+        if begin < min(end, span)
+    ]
+
+
+def group_users_by_location(users: list[User], precision: int | None = None) -> dict[LocationKey, list[User]]:
+    """Groups users who get the same weather data: same coordinates (rounded if precision is set)"""
+    locations: dict[LocationKey, list[User]] = {}
     for user in users:
-        weather_forecast: str = await weather.get_weather_forecast(user_id=user.id)
-        current_weather: str = await weather.get_current_weather(user_id=user.id)
+        key: LocationKey = get_location_key(settings=user.settings, precision=precision)
+        locations.setdefault(key, []).append(user)
+    return locations
+
+
+async def prepare_location_updates(forecasts: ForecastImageCache, subscribers: list[User]) -> list[BroadcastJob]:
+    """Requests the weather of the location once and prepares the updates of all its subscribers"""
+    location_weather: LocationWeather = await weather.fetch_weather(settings=subscribers[0].settings)
+    if location_weather.current:
+        utc_offset: int = location_weather.current.utc_offset
+        outdated: list[int] = [user.id for user in subscribers if user.utc_offset != utc_offset]
+        if outdated:
+            await database.save_utc_offset(user_ids=outdated, utc_offset=utc_offset)
+    images: dict[str, ForecastImage | None] = {}  # the image only differs by the units
+    captions: dict[tuple[str, str, str], str] = {}  # the caption differs by the city, language and units
+    jobs: list[BroadcastJob] = []
+    for user in subscribers:
+        if user.settings.units not in images:
+            images[user.settings.units] = (
+                await forecasts.get_image(data=location_weather.forecast, units=user.settings.units)
+                if location_weather.forecast
+                else None
+            )
+        caption_key: tuple[str, str, str] = (user.settings.city, user.settings.lang, user.settings.units)
+        if caption_key not in captions:
+            captions[caption_key] = await weather.format_current_weather(
+                weather_data=location_weather.current, settings=user.settings, stale=location_weather.stale
+            )
+        jobs.append(BroadcastJob(user=user, photo=images[user.settings.units], caption=captions[caption_key]))
+    return jobs
+
+
+async def broadcast_locations(
+    broadcaster: Broadcaster, forecasts: ForecastImageCache, locations: Queue[list[User]]
+) -> None:
+    """Prepares the updates of locations from the queue and passes them to the broadcaster until the queue is empty"""
+    while not locations.empty():
+        subscribers: list[User] = locations.get_nowait()
         try:
-            dialog: Message = await dp.bot.send_photo(
-                chat_id=user.id, photo=InputFile(weather_forecast), caption=current_weather, disable_notification=True
+            jobs: list[BroadcastJob] = await prepare_location_updates(forecasts=forecasts, subscribers=subscribers)
+        except Exception as ex:
+            logger.error("Failed to prepare the weather for %s: %s", subscribers[0].settings.city, repr(ex))
+            for user in subscribers:  # the location is retried by one of the next runs, the others go on
+                await broadcaster.postpone(user=user, ex=ex)
+            continue
+        for job in jobs:
+            await broadcaster.put(job)
+
+
+async def update_weather_data(dp: Dispatcher, batches: AsyncIterator[list[User]], precision: int | None) -> None:
+    """
+    Updates weather data for the users batch by batch, requesting the weather once for every distinct location,
+    the images of a batch are released before the next batch is read
+    """
+    config: Config = dp.bot.get("config")
+    forecasts: ForecastImageCache = ForecastImageCache()
+    async with Broadcaster(bot=dp.bot, settings=config.broadcast, forecasts=forecasts) as broadcaster:
+        async for users in batches:
+            locations: Queue[list[User]] = Queue()
+            for subscribers in group_users_by_location(users=users, precision=precision).values():
+                locations.put_nowait(subscribers)
+            logger.info("Weather update of %s users in %s locations", len(users), locations.qsize())
+            await gather(
+                *(
+                    broadcast_locations(broadcaster=broadcaster, forecasts=forecasts, locations=locations)
+                    for _ in range(min(config.schedule.location_workers, locations.qsize()))
+                )
+            )
+            forecasts.release_images()
+
+
+class StaggeredUpdates:
+    """Spreads scheduled weather updates over the refresh interval, each location gets its own stable time"""
+
+    def __init__(self, dp: Dispatcher, governor: QuotaGovernor, settings: ScheduleSettings) -> None:
+        """Creates the updates, users whose time has come are processed by the run method"""
+        self._dp = dp
+        self._governor = governor
+        self._settings = settings
+        self._refresh_plan: RefreshPlan | None = None
+        self._planned_window: float = 0.0  # beginning of the window for which the plan was made
+
+    def get_slot_ranges(self, started: float, now: float, interval: int, utc_offsets: list[int]) -> list[SlotRange]:
+        """
+        Returns the users whose update time falls within the period, the location hash sets the time in the interval:
+        hash / 2**32 of the interval in UTC, or of the morning spread from the morning hour in the user's time zone
+
+        :param started: beginning of the period
+        :param now: end of the period
+        :param interval: seconds between the updates of the same user
+        :param utc_offsets: known time zones of the users' cities, used if the updates are aligned to the morning
+        :return: ranges of location hashes in each time zone
+        """
+        length: float = min(now - started, interval)
+        if not self._settings.align_to_morning:
+            return [
+                SlotRange(start=start, end=end, aligned=False, utc_offset=None)
+                for start, end in get_hash_ranges(start=started, length=length, period=interval, span=interval)
+            ]
+        slot_ranges: list[SlotRange] = [  # the time zone becomes known after the first update
+            SlotRange(start=start, end=end, aligned=True, utc_offset=None)
+            for start, end in get_hash_ranges(start=started, length=length, period=interval, span=interval)
+        ]
+        for utc_offset in utc_offsets:
+            morning: int = self._settings.morning_hour * 3600 - utc_offset  # in UTC
+            slot_ranges.extend(
+                SlotRange(start=start, end=end, aligned=True, utc_offset=utc_offset)
+                for start, end in get_hash_ranges(
+                    start=started - morning, length=length, period=interval, span=MORNING_SPREAD
+                )
             )
-            await database.save_dialog_id(user_id=user.id, dialog_id=dialog.message_id)
-        except (BotBlocked, UserDeactivated):
-            await database.delete_user(user_id=user.id)
-        except RetryAfter as ex:
-            await sleep(ex.timeout)
-            dialog = await dp.bot.send_photo(
-                chat_id=user.id, photo=InputFile(weather_forecast), caption=current_weather, disable_notification=True
+        return slot_ranges
+
+    async def run(self) -> None:
+        """
+        Adds users of the leased shards whose time has come since the previous run to the broadcast queue,
+        then updates weather data for all pending users of the shards, including those left by a restart or postponed
+        """
+        now: float = time()
+        progress: dict[int, float] = await shard_leases.claim(
+            shards=self._settings.shards, lease_ttl=self._settings.lease_ttl
+        )
+        if self._refresh_plan is None or now - self._planned_window >= PLANNING_WINDOW:
+            self._refresh_plan = await self._governor.plan()
+            self._planned_window = now - now % PLANNING_WINDOW
+        if self._refresh_plan.run and progress:
+            utc_offsets: list[int] = await broadcast_store.get_time_zones() if self._settings.align_to_morning else []
+            periods: dict[float, list[int]] = {}  # shards by the beginning of the period, usually it is the same
+            for shard, processed_until in progress.items():
+                # updates missed while no process served the shard for a long time are not caught up
+                periods.setdefault(max(processed_until, now - 2 * self._settings.lease_ttl), []).append(shard)
+            for started, shards in periods.items():
+                await broadcast_store.enqueue_due_users(
+                    slot_ranges=self.get_slot_ranges(
+                        started=started, now=now, interval=self._refresh_plan.interval * 3600, utc_offsets=utc_offsets
+                    ),
+                    shards=shards,
+                    total_shards=self._settings.shards,
+                )
+        await shard_leases.save_progress(shards=list(progress), processed_until=now)
+        if not self._refresh_plan.run or not progress:
+            return
+        if await broadcast_store.has_due_users(shards=list(progress)):
+            await update_weather_data(
+                dp=self._dp,
+                batches=broadcast_store.iter_due_users(shards=list(progress)),
+                precision=self._refresh_plan.precision,
+            )
+            logger.info(
+                "Scheduled updates since %s: %s",
+                datetime.fromtimestamp(self._planned_window).strftime("%H:%M"),
+                await broadcast_store.get_queue_stats(since=self._planned_window),
             )
-            await database.save_dialog_id(user_id=user.id, dialog_id=dialog.message_id)
-        finally:
-            await dp.bot.delete_message(chat_id=user.id, message_id=user.dialog_id)
-            if weather_forecast[-12:-4] != "bot_logo":
-                os_remove(weather_forecast)
 
 
 async def schedule(dp: Dispatcher) -> None:
     """Creates a weather update task in the scheduler"""
+    config: Config = dp.bot.get("config")
+    updates: StaggeredUpdates = StaggeredUpdates(
+        dp=dp, governor=QuotaGovernor(settings=config.quota), settings=config.schedule
+    )
     scheduler: AsyncIOScheduler = AsyncIOScheduler()
+    scheduler.add_job(func=updates.run, trigger="interval", seconds=config.schedule.slice_interval)
     scheduler.add_job(
-        func=update_weather_data, trigger="cron", hour="0, 3, 6, 9, 12, 15, 18, 21", args=(dp,), timezone="UTC"
+        func=shard_leases.renew,
+        trigger="interval",
+        seconds=config.schedule.lease_ttl // 3,
+        kwargs={"lease_ttl": config.schedule.lease_ttl},
     )
+    scheduler.add_job(func=database.flush_api_counter, trigger="interval", seconds=API_COUNTER_FLUSH_INTERVAL)
+    scheduler.add_job(func=weather.delete_expired_geocoding_cache, trigger="interval", hours=24)
+    scheduler.add_job(func=weather.log_stats, trigger="interval", seconds=STATS_LOG_INTERVAL)
     scheduler.start()
@@ -0,0 +1,74 @@
+"""Receiving of updates by webhook"""
+
+from asyncio import Semaphore, Task, create_task, gather
+from hmac import compare_digest
+
+from aiogram import Dispatcher
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY, WebhookRequestHandler
+from aiogram.types import Update
+from aiohttp import web
+
+from tgbot.config import WebhookSettings
+from tgbot.misc.logger import logger
+
+
+SECRET_TOKEN_HEADER: str = "X-Telegram-Bot-Api-Secret-Token"
+SECRET_TOKEN_KEY: str = "SECRET_TOKEN"
+UPDATES_SEMAPHORE_KEY: str = "UPDATES_SEMAPHORE"
+UPDATE_TASKS_KEY: str = "UPDATE_TASKS"
+
+
+async def process_update(dp: Dispatcher, update: Update, semaphore: Semaphore) -> None:
+    """Processes the update when fewer than the maximum number of updates are in progress"""
+    async with semaphore:
+        await dp.process_update(update)
+
+
+class SecretWebhookRequestHandler(WebhookRequestHandler):
+    """Webhook request handler that checks the secret token and processes updates in the background"""
+
+    async def post(self) -> web.Response:
+        """
+        Accepts the update if the request came from Telegram and answers at once, so that slow handlers
+        do not make Telegram wait and resend updates, the update is processed when a slot of concurrent updates is free
+        """
+        secret_token: str = self.request.app[SECRET_TOKEN_KEY]
+        if not compare_digest(self.request.headers.get(SECRET_TOKEN_HEADER, "").encode(), secret_token.encode()):
+            raise web.HTTPUnauthorized()
+        self.validate_ip()
+        dp: Dispatcher = self.get_dispatcher()
+        update: Update = await self.parse_update(dp.bot)
+        task: Task = create_task(
+            process_update(dp=dp, update=update, semaphore=self.request.app[UPDATES_SEMAPHORE_KEY])
+        )
+        tasks: set[Task] = self.request.app[UPDATE_TASKS_KEY]
+        tasks.add(task)  # a reference is kept until the task is done
+        task.add_done_callback(tasks.discard)
+        return web.Response(text="ok")
+
+
+async def start_webhook(dp: Dispatcher, settings: WebhookSettings) -> web.AppRunner:
+    """Starts the web server for updates and sets the webhook, the runner is passed to stop_webhook on shutdown"""
+    if not settings.secret_token:
+        raise RuntimeError("WEBHOOK_SECRET_TOKEN is required, without it anyone can send updates to the webhook")
+    app: web.Application = web.Application()
+    app[BOT_DISPATCHER_KEY] = dp
+    app[SECRET_TOKEN_KEY] = settings.secret_token
+    app[UPDATES_SEMAPHORE_KEY] = Semaphore(settings.max_concurrent_updates)
+    app[UPDATE_TASKS_KEY] = set()
+    app.router.add_route(method="*", path=settings.path, handler=SecretWebhookRequestHandler)
+    runner: web.AppRunner = web.AppRunner(app=app)
+    await runner.setup()
+    await web.TCPSite(runner=runner, host=settings.host, port=settings.port).start()
+    await dp.bot.set_webhook(url=settings.url, secret_token=settings.secret_token, drop_pending_updates=True)
+    logger.info("Webhook is set, updates are received on %s:%s%s", settings.host, settings.port, settings.path)
+    return runner
+
+
+async def stop_webhook(runner: web.AppRunner) -> None:
+    """Stops the web server and cancels the updates still in progress"""
+    tasks: set[Task] = runner.app[UPDATE_TASKS_KEY]
+    await runner.cleanup()
+    for task in list(tasks):
+        task.cancel()
+    await gather(*tasks, return_exceptions=True)
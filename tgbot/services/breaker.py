@@ -0,0 +1,51 @@
+"""Protection against waiting for an unavailable external API"""
+
+from time import monotonic
+
+from tgbot.misc.logger import logger
+
+
+class CircuitOpenError(Exception):
+    """The request was not made, because the endpoint is unavailable"""
+
+
+class CircuitBreaker:
+    """Stops requests to an endpoint after several failures in a row, then lets one trial request through at a time"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float) -> None:
+        """Creates a closed circuit breaker, requests are let through"""
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures: int = 0
+        self._opened_at: float | None = None  # time of the opening or of the last trial request
+
+    @property
+    def is_open(self) -> bool:
+        """Checks whether the endpoint is considered unavailable"""
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        """Checks whether a request can be made, after the reset timeout one trial request is let through"""
+        if self._opened_at is None:
+            return True
+        if monotonic() - self._opened_at < self._reset_timeout:
+            return False
+        self._opened_at = monotonic()  # the next trial request waits for the reset timeout again
+        return True
+
+    def record_success(self) -> None:
+        """Closes the circuit breaker after a successful request"""
+        if self._opened_at is not None:
+            logger.warning("%s is available again", self._name)
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self) -> None:
+        """Counts the failed request, opens the circuit breaker if there are too many failures in a row"""
+        self._failures += 1
+        if self._opened_at is None and self._failures >= self._failure_threshold:
+            logger.warning("%s is unavailable, requests are stopped after %s failures", self._name, self._failures)
+            self._opened_at = monotonic()
+        elif self._opened_at is not None:
+            self._opened_at = monotonic()
@@ -0,0 +1,247 @@
+"""Concurrent rate-limited sending of messages to many users"""
+
+from asyncio import Lock, Queue, Task, create_task, gather, sleep
+from collections import deque
+from dataclasses import dataclass, field
+from time import monotonic
+from types import TracebackType
+from typing import Any, Awaitable, Callable, TypeVar
+
+from aiogram import Bot
+from aiogram.types import Message
+from aiogram.utils.exceptions import (
+    BadRequest,
+    BotBlocked,
+    MessageNotModified,
+    RetryAfter,
+    TelegramAPIError,
+    UserDeactivated,
+)
+
+from tgbot.config import BroadcastSettings
+from tgbot.misc.logger import logger
+from tgbot.services.broadcast_store import broadcast_store
+from tgbot.services.classes import BroadcastJob, BroadcastStats, User
+from tgbot.services.database import database
+from tgbot.services.media import ForecastImageCache
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """Limits the rate of requests, can be paused entirely"""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """Creates a full bucket that refills with the specified rate of tokens per second"""
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = monotonic()
+        self._paused_until: float = 0.0
+        self._lock = Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Stops issuing tokens for the specified number of seconds"""
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        """Waits until a token is available and takes it"""
+        async with self._lock:
+            while True:
+                now: float = monotonic()
+                if now < self._paused_until:
+                    await sleep(self._paused_until - now)
+                    self._updated = monotonic()
+                    continue
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await sleep((1 - self._tokens) / self._rate)
+
+
+class RateLimiter:
+    """Global rate limit of requests and the minimum interval between requests to the same chat"""
+
+    def __init__(self, rate: float, chat_interval: float) -> None:
+        """Creates a limiter with the global rate in requests per second and the chat interval in seconds"""
+        self._bucket = TokenBucket(rate=rate, capacity=rate)
+        self._chat_interval = chat_interval
+        self._chat_calls: dict[int, float] = {}
+
+    def pause(self, seconds: float) -> None:
+        """Stops all requests for the specified number of seconds"""
+        self._bucket.pause(seconds=seconds)
+
+    async def acquire(self, chat_id: int | None = None) -> None:
+        """Waits until a request can be made, to the specified chat if chat_id is given"""
+        if chat_id is not None:
+            delay: float = self._chat_calls.get(chat_id, 0.0) + self._chat_interval - monotonic()
+            if delay > 0:
+                await sleep(delay)
+            self._chat_calls[chat_id] = monotonic()
+        await self._bucket.acquire()
+
+
+@dataclass
+class BroadcastProgress:
+    """Counters of a running broadcast"""
+
+    started: float = field(default_factory=monotonic)
+    sent: int = 0
+    edited: int = 0
+    failed: int = 0
+    retried: int = 0
+    recent: deque[float] = field(default_factory=deque)  # time of the requests made in the last rate window
+
+
+class Broadcaster:
+    """Sends the weather to users with a pool of workers fed from a queue, failed updates are postponed"""
+
+    _MAX_ATTEMPTS: int = 5
+    _RETRY_DELAY: float = 60.0  # seconds before the first retry, it doubles with every failed attempt
+    _RATE_WINDOW: float = 10.0
+    _REPORT_INTERVAL: float = 30.0
+
+    def __init__(self, bot: Bot, settings: BroadcastSettings, forecasts: ForecastImageCache) -> None:
+        """Creates a broadcaster, workers are started when entering the context"""
+        self._bot = bot
+        self._forecasts = forecasts
+        self._settings = settings
+        self._queue: Queue[BroadcastJob] = Queue(maxsize=settings.queue_size)
+        self._limiter = RateLimiter(rate=settings.rate_limit, chat_interval=settings.chat_interval)
+        self._progress = BroadcastProgress()
+        self._tasks: list[Task] = []
+
+    async def __aenter__(self) -> "Broadcaster":
+        """Starts the workers and the progress reporter"""
+        self._tasks = [create_task(self._worker()) for _ in range(self._settings.workers)]
+        self._tasks.append(create_task(self._reporter()))
+        return self
+
+    async def __aexit__(
+        self, exc_type: type[BaseException] | None, exc: BaseException | None, traceback: TracebackType | None
+    ) -> None:
+        """Waits until all queued jobs are processed and stops the workers, even if the broadcast is cancelled"""
+        try:
+            if exc_type is None:
+                await self._queue.join()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await gather(*self._tasks, return_exceptions=True)
+            logger.info("Broadcast finished: %s, %s", self.stats, self._forecasts)
+
+    @property
+    def stats(self) -> BroadcastStats:
+        """Returns the current progress of the broadcast"""
+        now: float = monotonic()
+        while self._progress.recent and self._progress.recent[0] < now - self._RATE_WINDOW:
+            self._progress.recent.popleft()
+        return BroadcastStats(
+            sent=self._progress.sent,
+            edited=self._progress.edited,
+            failed=self._progress.failed,
+            retried=self._progress.retried,
+            queue_depth=self._queue.qsize(),
+            rate=round(len(self._progress.recent) / self._RATE_WINDOW, 1),
+            elapsed=round(now - self._progress.started, 1),
+        )
+
+    async def put(self, job: BroadcastJob) -> None:
+        """Adds a job to the queue, waits if the queue is full"""
+        await self._queue.put(job)
+
+    async def _reporter(self) -> None:
+        """Periodically logs the progress of the broadcast"""
+        while True:
+            await sleep(self._REPORT_INTERVAL)
+            logger.info("Broadcast in progress: %s", self.stats)
+
+    async def _call_api(
+        self, chat_id: int, method: Callable[..., Awaitable[T]], paced: bool = True, **kwargs: Any
+    ) -> T:
+        """Calls the Telegram API method respecting the rate limits, pauses all workers on flood control"""
+        await self._limiter.acquire(chat_id=chat_id if paced else None)
+        self._progress.recent.append(monotonic())
+        try:
+            return await method(chat_id=chat_id, **kwargs)
+        except RetryAfter as ex:
+            logger.warning("Flood control exceeded, broadcast paused for %s seconds", ex.timeout)
+            self._limiter.pause(seconds=ex.timeout)
+            raise
+
+    async def _send_photo(self, chat_id: int, job: BroadcastJob) -> Message:
+        """Sends the weather of the job to the chat"""
+        message: Message = await self._forecasts.send(
+            bot=self._bot, chat_id=chat_id, forecast=job.photo, caption=job.caption, disable_notification=True
+        )
+        return message
+
+    async def _edit_photo(self, chat_id: int, job: BroadcastJob) -> bool:
+        """Replaces the previous dialog message with the weather of the job, returns False if it can not be edited"""
+        if job.photo is None:
+            return False
+        try:
+            await self._forecasts.edit(
+                bot=self._bot, chat_id=chat_id, forecast=job.photo, caption=job.caption, message_id=job.user.dialog_id
+            )
+        except MessageNotModified:
+            pass  # the message already shows the same weather
+        except BadRequest as ex:
+            logger.debug("Failed to edit the message of the user with id=%s: %s", chat_id, ex)
+            return False
+        return True
+
+    async def _deliver(self, job: BroadcastJob) -> None:
+        """Edits the previous dialog message, or sends the weather to the user and deletes the previous message"""
+        try:
+            if self._settings.edit_messages and await self._call_api(
+                chat_id=job.user.id, method=self._edit_photo, job=job
+            ):
+                await broadcast_store.save_result(user_id=job.user.id)
+                self._progress.sent += 1
+                self._progress.edited += 1
+                return
+            dialog: Message = await self._call_api(chat_id=job.user.id, method=self._send_photo, job=job)
+        except (BotBlocked, UserDeactivated):
+            await database.delete_user(user_id=job.user.id)
+            self._progress.failed += 1
+            return
+        await database.save_dialog_id(user_id=job.user.id, dialog_id=dialog.message_id)
+        await broadcast_store.save_result(user_id=job.user.id)
+        self._progress.sent += 1
+        try:
+            await self._call_api(
+                chat_id=job.user.id, method=self._bot.delete_message, paced=False, message_id=job.user.dialog_id
+            )
+        except TelegramAPIError:
+            pass  # the previous message may have already been deleted by the user
+
+    async def postpone(self, user: User, ex: Exception) -> None:
+        """Postpones the update of the user in the database, it is retried by one of the next scheduled runs"""
+        self._progress.retried += 1
+        retry_delay: float = (
+            max(float(ex.timeout), self._RETRY_DELAY) if isinstance(ex, RetryAfter) else self._RETRY_DELAY
+        )
+        try:
+            await broadcast_store.save_result(
+                user_id=user.id, retry_delay=retry_delay, max_attempts=self._MAX_ATTEMPTS
+            )
+        except Exception as db_ex:
+            logger.error("Failed to postpone the update of the user with id=%s: %s", user.id, repr(db_ex))
+
+    async def _worker(self) -> None:
+        """Processes jobs from the queue"""
+        while True:
+            job: BroadcastJob = await self._queue.get()
+            try:
+                await self._deliver(job=job)
+            except Exception as ex:
+                self._progress.failed += 1
+                logger.error("Failed to send the weather to the user with id=%s: %s", job.user.id, repr(ex))
+                await self.postpone(user=job.user, ex=ex)
+            finally:
+                self._queue.task_done()
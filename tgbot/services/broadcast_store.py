@@ -0,0 +1,247 @@
+"""Storage of the shard leases and of the queue of scheduled updates in the database"""
+
+from math import ceil
+from sqlite3 import Row
+from time import time
+from typing import AsyncIterator
+
+from tgbot.services.classes import BroadcastQueueStats, SlotRange, User
+from tgbot.services.database import Database, database, get_user
+
+
+class BroadcastStore:
+    """Tables of the scheduled updates, they are accessed through the connection pool of the database"""
+
+    _PAGE_SIZE: int = 1000
+
+    def __init__(self, db: Database) -> None:
+        """Uses the connections of the database"""
+        self._database = db
+
+    async def claim_shards(self, owner: str, shards: int, lease_ttl: int) -> dict[int, float]:
+        """
+        Renews the leases of the process and evens out the number of shards between running processes:
+        releases extra shards or takes free and expired ones
+
+        :param owner: unique identifier of the bot process
+        :param shards: total number of shards
+        :param lease_ttl: lifetime of the leases in seconds
+        :return: leased shards and the time until which their scheduled updates have been processed
+        """
+        now: float = time()
+        async with self._database.acquire() as db:
+            await db.execute("""BEGIN IMMEDIATE;""")
+            await db.execute("""DELETE FROM broadcast_workers WHERE expires<=?;""", (now,))
+            await db.execute(
+                """
+                INSERT INTO broadcast_workers (owner, expires) VALUES (?, ?)
+                ON CONFLICT (owner) DO UPDATE SET expires=excluded.expires;
+                """,
+                (owner, now + lease_ttl),
+            )
+            await db.executemany(
+                """INSERT OR IGNORE INTO broadcast_shards (shard, processed_until) VALUES (?, ?);""",
+                [(shard, now) for shard in range(shards)],
+            )
+            await db.execute("""UPDATE broadcast_shards SET expires=? WHERE owner=?;""", (now + lease_ttl, owner))
+            async with db.execute("""SELECT COUNT() FROM broadcast_workers;""") as cursor:
+                workers: int = [row[0] async for row in cursor][0]
+            fair_share: int = ceil(shards / workers)
+            async with db.execute(
+                """SELECT shard FROM broadcast_shards WHERE owner=? AND shard<? ORDER BY shard;""", (owner, shards)
+            ) as cursor:
+                leased: list[int] = [row[0] async for row in cursor]
+            if len(leased) > fair_share:
+                await db.executemany(
+                    """UPDATE broadcast_shards SET owner='', expires=0 WHERE shard=?;""",
+                    [(shard,) for shard in leased[fair_share:]],
+                )
+            elif len(leased) < fair_share:
+                async with db.execute(
+                    """SELECT shard FROM broadcast_shards WHERE expires<=? AND shard<? ORDER BY shard LIMIT ?;""",
+                    (now, shards, fair_share - len(leased)),
+                ) as cursor:
+                    free: list[int] = [row[0] async for row in cursor]
+                await db.executemany(
+                    """UPDATE broadcast_shards SET owner=?, expires=? WHERE shard=?;""",
+                    [(owner, now + lease_ttl, shard) for shard in free],
+                )
+            async with db.execute(
+                """SELECT shard, processed_until FROM broadcast_shards WHERE owner=? AND shard<?;""", (owner, shards)
+            ) as cursor:
+                progress: dict[int, float] = {row[0]: row[1] async for row in cursor}
+            await db.commit()
+        return progress
+
+    async def renew_shards(self, owner: str, lease_ttl: int) -> None:
+        """Extends the leases of the process, while it is busy with a long update"""
+        expires: float = time() + lease_ttl
+        async with self._database.acquire() as db:
+            await db.execute("""UPDATE broadcast_workers SET expires=? WHERE owner=?;""", (expires, owner))
+            await db.execute("""UPDATE broadcast_shards SET expires=? WHERE owner=?;""", (expires, owner))
+            await db.commit()
+
+    async def save_shard_progress(self, owner: str, shards: list[int], processed_until: float) -> None:
+        """Saves the time until which scheduled updates of the shards still leased by the process have been processed"""
+        async with self._database.acquire() as db:
+            await db.executemany(
+                """UPDATE broadcast_shards SET processed_until=? WHERE owner=? AND shard=?;""",
+                [(processed_until, owner, shard) for shard in shards],
+            )
+            await db.commit()
+
+    async def release_shards(self, owner: str) -> None:
+        """Releases the leases of the process so that other processes can take its shards at once"""
+        async with self._database.acquire() as db:
+            await db.execute("""DELETE FROM broadcast_workers WHERE owner=?;""", (owner,))
+            await db.execute("""UPDATE broadcast_shards SET owner='', expires=0 WHERE owner=?;""", (owner,))
+            await db.commit()
+
+    async def get_time_zones(self) -> list[int]:
+        """Returns the distinct known time zones of the users' cities, each one is found by a search in the index"""
+        async with self._database.acquire() as db:
+            async with db.execute(
+                """
+                WITH RECURSIVE time_zones (utc_offset) AS (
+                    SELECT MIN(utc_offset) FROM users WHERE units NOT NULL
+                    UNION ALL
+                    SELECT (SELECT MIN(utc_offset) FROM users WHERE units NOT NULL AND utc_offset>time_zones.utc_offset)
+                    FROM time_zones WHERE utc_offset NOT NULL
+                )
+                SELECT utc_offset FROM time_zones WHERE utc_offset NOT NULL;
+                """
+            ) as cursor:
+                utc_offsets: list[int] = [row[0] async for row in cursor]
+        return utc_offsets
+
+    async def enqueue_due_users(self, slot_ranges: list[SlotRange], shards: list[int], total_shards: int) -> None:
+        """
+        Adds scheduled updates of the users of the shards to the broadcast queue, replacing the previous ones
+
+        :param slot_ranges: ranges of the location hashes of the users whose updates are due
+        :param shards: shards leased by the process
+        :param total_shards: total number of shards, the shard of a user is the location hash modulo this number
+        """
+        now: float = time()
+        async with self._database.acquire() as db:
+            for slot_range in slot_ranges:
+                await db.execute(
+                    f"""
+                    INSERT INTO broadcast_queue (user_id, shard, state, attempts, retry_at, created, location_hash)
+                    SELECT id, location_hash%?, 'pending', 0, ?, ?, location_hash FROM users
+                    WHERE units NOT NULL AND {"utc_offset IS ? AND" if slot_range.aligned else ""}
+                    location_hash>=? AND location_hash<? AND location_hash%? IN ({", ".join("?" * len(shards))})
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        shard=excluded.shard, state='pending', attempts=0, retry_at=excluded.retry_at,
+                        created=excluded.created, location_hash=excluded.location_hash;
+                    """,
+                    (
+                        total_shards,
+                        now,
+                        now,
+                        *((slot_range.utc_offset,) if slot_range.aligned else ()),
+                        slot_range.start,
+                        slot_range.end,
+                        total_shards,
+                        *shards,
+                    ),
+                )
+            await db.commit()
+
+    async def has_due_users(self, shards: list[int]) -> bool:
+        """Checks whether the shards have pending scheduled updates that are not postponed"""
+        async with self._database.acquire() as db:
+            async with db.execute(
+                f"""
+                SELECT EXISTS (
+                    SELECT 1 FROM broadcast_queue
+                    WHERE shard IN ({", ".join("?" * len(shards))}) AND state='pending' AND retry_at<=?
+                );
+                """,
+                (*shards, time()),
+            ) as cursor:
+                exists: bool = bool([row[0] async for row in cursor][0])
+        return exists
+
+    async def iter_due_users(self, shards: list[int]) -> AsyncIterator[list[User]]:
+        """
+        Yields users of the shards whose scheduled updates are pending and not postponed, in batches of about
+        _PAGE_SIZE users ordered by the location, users of the same location are never split between batches
+        """
+        now: float = time()
+        for shard in shards:
+            last_key: tuple[int, int] = (-1, -1)  # location hash and id of the last read user
+            rest: list[User] = []  # users of the last location of the page, it may continue on the next page
+            while True:
+                async with self._database.acquire() as db:  # the connection is not held while the batch is processed
+                    async with db.execute(
+                        """
+                        SELECT users.id, dialog_id, lang, city, latitude, longitude, units, utc_offset,
+                            broadcast_queue.location_hash
+                        FROM broadcast_queue JOIN users ON users.id=broadcast_queue.user_id
+                        WHERE shard=? AND state='pending' AND retry_at<=? AND units NOT NULL
+                        AND (broadcast_queue.location_hash, user_id)>(?, ?)
+                        ORDER BY broadcast_queue.location_hash, user_id LIMIT ?;
+                        """,
+                        (shard, now, *last_key, self._PAGE_SIZE),
+                    ) as cursor:
+                        rows: list[Row] = [row async for row in cursor]
+                users: list[User] = rest + [get_user(row=row) for row in rows]
+                if len(rows) < self._PAGE_SIZE:
+                    if users:
+                        yield users
+                    break
+                location_hashes: list[int] = [last_key[0]] * len(rest) + [row[8] for row in rows]
+                last_key = (rows[-1][8], rows[-1][0])
+                split: int = location_hashes.index(last_key[0])
+                if split:
+                    yield users[:split]
+                rest = users[split:]
+
+    async def save_result(self, user_id: int, retry_delay: float | None = None, max_attempts: int = 1) -> None:
+        """
+        Marks the scheduled update of the user as sent, or postpones it after a failure
+
+        :param user_id: Telegram user ID
+        :param retry_delay: None if the update is sent, otherwise the delay before the first retry in seconds,
+            it doubles with every failed attempt
+        :param max_attempts: number of attempts after which the update is marked as failed
+        """
+        async with self._database.acquire() as db:
+            if retry_delay is None:
+                await db.execute("""UPDATE broadcast_queue SET state='sent' WHERE user_id=?;""", (user_id,))
+            else:
+                await db.execute(
+                    """
+                    UPDATE broadcast_queue SET
+                        attempts=attempts+1,
+                        state=CASE WHEN attempts+1>=? THEN 'failed' ELSE 'pending' END,
+                        retry_at=?+?*(1<<attempts)
+                    WHERE user_id=?;
+                    """,
+                    (max_attempts, time(), retry_delay, user_id),
+                )
+            await db.commit()
+
+    async def get_queue_stats(self, since: float) -> BroadcastQueueStats:
+        """Returns the numbers of scheduled updates by state, which were added to the queue since the specified time"""
+        counters: dict[str, int] = {}
+        async with self._database.acquire() as db:
+            async with db.execute(
+                """
+                SELECT CASE WHEN state='pending' AND attempts>0 THEN 'retrying' ELSE state END, COUNT()
+                FROM broadcast_queue WHERE created>=? GROUP BY 1;
+                """,
+                (since,),
+            ) as cursor:
+                async for row in cursor:
+                    counters[row[0]] = row[1]
+        return BroadcastQueueStats(
+            pending=counters.get("pending", 0),
+            retrying=counters.get("retrying", 0),
+            sent=counters.get("sent", 0),
+            failed=counters.get("failed", 0),
+        )
+
+
+broadcast_store: BroadcastStore = BroadcastStore(db=database)
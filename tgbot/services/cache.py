@@ -0,0 +1,212 @@
+"""Caches for the results of requests to OpenWeatherMap"""
+
+from asyncio import Task, create_task, shield
+from collections import OrderedDict
+from json import dumps, loads
+from time import monotonic, time
+from typing import Any, Callable, Coroutine, Generic, NamedTuple, TypeVar
+
+from tgbot.config import CoalescingSettings, GeocodingCacheSettings, WeatherCacheSettings
+from tgbot.services.classes import CacheStats, CityData, CoalescingStats, LocationWeather
+from tgbot.services.database import database
+
+V = TypeVar("V")
+
+
+class TtlLruCache(Generic[V]):
+    """In-memory cache with a limited number of items, each of which expires after the specified time"""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        """Creates an empty cache"""
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._items: OrderedDict[str, tuple[float, V]] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key: str) -> V | None:
+        """Returns the value if it is in the cache and has not expired"""
+        item: tuple[float, V] | None = self._items.get(key)
+        if item is None or item[0] < monotonic():
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: str, value: V) -> None:
+        """Puts the value in the cache, removing the least recently used values if the cache is full"""
+        self._items[key] = (monotonic() + self._ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self._maxsize:
+            self._items.popitem(last=False)
+
+
+class SingleFlight(Generic[V]):
+    """Makes identical requests once: concurrent callers share the request in flight, later ones reuse its result"""
+
+    def __init__(self, settings: CoalescingSettings) -> None:
+        """Creates an empty set of requests"""
+        self._reuse_window = settings.reuse_window
+        self._results: TtlLruCache[V] = TtlLruCache(maxsize=settings.size, ttl=settings.reuse_window)
+        self._in_flight: dict[str, Task[V | None]] = {}
+        self._calls: int = 0
+        self._coalesced: int = 0
+
+    @property
+    def stats(self) -> CoalescingStats:
+        """Returns the numbers of requests made, coalesced with a request in flight and answered by a recent result"""
+        return CoalescingStats(calls=self._calls, coalesced=self._coalesced, reused=self._results.hits)
+
+    def _complete(self, key: str, task: Task[V | None]) -> None:
+        """Removes the finished request, keeps its successful result for reuse"""
+        del self._in_flight[key]
+        if self._reuse_window > 0 and not task.cancelled() and task.exception() is None:
+            result: V | None = task.result()
+            if result is not None:
+                self._results.set(key=key, value=result)
+
+    async def call(self, key: str, request: Callable[[], Coroutine[Any, Any, V | None]]) -> V | None:
+        """Returns the result of the request with the key, makes the request only if no identical one can be shared"""
+        if self._reuse_window > 0:
+            result: V | None = self._results.get(key=key)
+            if result is not None:
+                return result
+        task: Task[V | None] | None = self._in_flight.get(key)
+        if task is None:
+            task = create_task(request())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._complete(key=key, task=done))
+            self._calls += 1
+        else:
+            self._coalesced += 1
+        return await shield(task)  # a cancelled caller does not cancel the request for the others
+
+
+class WeatherCache:
+    """Last successfully obtained weather of locations, it is shown while OpenWeatherMap is unavailable"""
+
+    def __init__(self, settings: WeatherCacheSettings) -> None:
+        """Creates an empty cache"""
+        self._snapshots: TtlLruCache[LocationWeather] = TtlLruCache(maxsize=settings.size, ttl=settings.max_age)
+        self._refreshes: dict[str, Task[LocationWeather]] = {}
+        self.stale: int = 0  # number of times the last weather was shown instead of the current one
+
+    def _save(self, key: str, location_weather: LocationWeather) -> None:
+        """Saves the weather if both the current weather and the forecast have been obtained"""
+        if location_weather.current and location_weather.forecast:
+            self._snapshots.set(key=key, value=location_weather)
+
+    def _complete_refresh(self, key: str, task: Task[LocationWeather]) -> None:
+        """Saves the weather obtained by the background refresh"""
+        del self._refreshes[key]
+        if not task.cancelled() and task.exception() is None:
+            self._save(key=key, location_weather=task.result())
+
+    async def get(
+        self, key: str, fetch: Callable[[], Coroutine[Any, Any, LocationWeather]], available: bool
+    ) -> LocationWeather:
+        """
+        Returns the weather of the location, the last obtained weather is marked as stale and replaces
+        the current weather without waiting if OpenWeatherMap is unavailable, or the parts that could not be obtained
+
+        :param key: key of the location
+        :param fetch: function that obtains the weather of the location
+        :param available: whether OpenWeatherMap is available
+        :return: weather of the location
+        """
+        last: LocationWeather | None = self._snapshots.get(key=key)
+        if last is not None and not available:
+            if key not in self._refreshes:  # the cache is updated as soon as OpenWeatherMap answers again
+                self._refreshes[key] = create_task(fetch())
+                self._refreshes[key].add_done_callback(lambda done: self._complete_refresh(key=key, task=done))
+            self.stale += 1
+            return last._replace(stale=True)
+        location_weather: LocationWeather = await fetch()
+        self._save(key=key, location_weather=location_weather)
+        if last is None or (location_weather.current and location_weather.forecast):
+            return location_weather
+        if location_weather.current is None:
+            self.stale += 1
+        return LocationWeather(
+            current=location_weather.current or last.current,
+            forecast=location_weather.forecast or last.forecast,
+            stale=location_weather.current is None,
+        )
+
+
+class GeocodingCache:
+    """City search results cached in memory and in the geocoding_cache table of the database"""
+
+    def __init__(self, settings: GeocodingCacheSettings) -> None:
+        """Creates an empty cache"""
+        self._memory: TtlLruCache[list[CityData]] = TtlLruCache(maxsize=settings.size, ttl=settings.memory_ttl)
+        self._database_ttl = settings.database_ttl
+        self._database_hits: int = 0
+
+    @staticmethod
+    def get_direct_key(city_name: str, lang_code: str) -> str:
+        """Returns the key of the search by the city name, the name must already be corrected"""
+        return f"direct:{lang_code}:{' '.join(city_name.split()).casefold()}"
+
+    @staticmethod
+    def get_reverse_key(latitude: float, longitude: float, lang_code: str) -> str:
+        """Returns the key of the search by coordinates, rounded to about one kilometer"""
+        return f"reverse:{lang_code}:{latitude:.2f}:{longitude:.2f}"
+
+    @property
+    def stats(self) -> CacheStats:
+        """Returns the numbers of hits in memory, in the database and misses"""
+        return CacheStats(
+            memory_hits=self._memory.hits,
+            database_hits=self._database_hits,
+            misses=self._memory.misses - self._database_hits,
+        )
+
+    async def get(self, key: str) -> list[CityData] | None:
+        """Returns the cached list of cities, looking in memory first and then in the database"""
+        cities: list[CityData] | None = self._memory.get(key=key)
+        if cities is not None:
+            return cities
+        saved_cities: str | None = None
+        async with database.acquire() as db:
+            async with db.execute(
+                """SELECT cities FROM geocoding_cache WHERE key=? AND created>?;""", (key, time() - self._database_ttl)
+            ) as cursor:
+                async for row in cursor:
+                    saved_cities = row[0]
+        if saved_cities is None:
+            return None
+        self._database_hits += 1
+        cities = [CityData(*city) for city in loads(saved_cities)]
+        self._memory.set(key=key, value=cities)
+        return cities
+
+    async def set(self, key: str, cities: list[CityData]) -> None:
+        """Puts the list of cities in memory and in the database"""
+        self._memory.set(key=key, value=cities)
+        async with database.acquire() as db:
+            await db.execute(
+                """
+                INSERT INTO geocoding_cache (key, cities, created) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET cities=excluded.cities, created=excluded.created;
+                """,
+                (key, dumps(cities, ensure_ascii=False), time()),
+            )
+            await db.commit()
+
+    async def delete_expired(self) -> None:
+        """Deletes expired results from the database"""
+        async with database.acquire() as db:
+            await db.execute("""DELETE FROM geocoding_cache WHERE created<=?;""", (time() - self._database_ttl,))
+            await db.commit()
+
+
+class ApiCaches(NamedTuple):
+    """Caches of one OpenWeatherMap API client"""
+
+    single_flight: SingleFlight[list | dict]  # identical requests made at the same time or shortly after each other
+    weather: WeatherCache
+    geocoding: GeocodingCache
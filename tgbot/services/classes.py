@@ -1,15 +1,9 @@
 """Classes for working with data"""
 
+from array import array
 from typing import NamedTuple
 
 
-class User(NamedTuple):
-    """A class that describes a user"""
-
-    id: int
-    dialog_id: int
-
-
 class UserWeatherSettings(NamedTuple):
     """A class that describes the user's weather settings"""
 
@@ -20,6 +14,15 @@ class UserWeatherSettings(NamedTuple):
     units: str
 
 
+class User(NamedTuple):
+    """A class that describes a user"""
+
+    id: int
+    dialog_id: int
+    settings: UserWeatherSettings
+    utc_offset: int | None  # seconds, time zone of the user's city if it is already known
+
+
 class CityData(NamedTuple):
     """A class describing city data"""
 
@@ -30,14 +33,15 @@ class CityData(NamedTuple):
 
 
 class CurrentWeatherData(NamedTuple):
-    """A class describing current weather data"""
+    """A class describing current weather data, temperatures are in °C and speeds in m/s unless converted"""
 
-    temp: int
-    feels_like: int
+    temp: float
+    feels_like: float
+    dew_point: float
     weather_code: int
-    weather_description: str
-    wind_speed: int
-    gust: int | None
+    weather_description: str  # in English, only shown for weather codes unknown to the bot
+    wind_speed: float
+    gust: float | None
     humidity: int
     pressure: int
     visibility: float
@@ -45,12 +49,109 @@ class CurrentWeatherData(NamedTuple):
     time: str
     sunrise: str
     sunset: str
+    utc_offset: int  # seconds
 
 
 class ForecastData(NamedTuple):
-    """A class describing weather forecast data"""
+    """A class describing weather forecast data, temperatures are in °C and speeds in m/s unless converted"""
 
     time: list[str]
     ico_code: list[str]
-    temp: list[str]
-    wind_speed: list[str]
+    temp: array  # array("f") of temperatures
+    wind_speed: array  # array("f") of wind speeds
+
+
+class LocationWeather(NamedTuple):
+    """A class describing the current weather and the forecast for one location"""
+
+    current: CurrentWeatherData | None
+    forecast: ForecastData | None
+    stale: bool = False  # the current weather is the last one obtained, OpenWeatherMap is unavailable
+
+
+class WeatherSnapshot(NamedTuple):
+    """A class describing the weather ready to be sent to the user"""
+
+    caption: str
+    image: bytes | None
+
+
+class HttpPoolStats(NamedTuple):
+    """A class describing the connection pool statistics of the HTTP client"""
+
+    requests: int
+    connections_created: int
+    connections_reused: int
+    dns_cache_hits: int
+    dns_cache_misses: int
+
+
+class ForecastImage(NamedTuple):
+    """A class describing a drawn weather forecast image and the hash of its content"""
+
+    key: str
+    image: bytes
+
+
+class BroadcastJob(NamedTuple):
+    """A class describing the weather data to be sent to one user"""
+
+    user: User
+    photo: ForecastImage | None
+    caption: str
+
+
+class BroadcastStats(NamedTuple):
+    """A class describing the progress of a broadcast"""
+
+    sent: int
+    edited: int
+    failed: int
+    retried: int
+    queue_depth: int
+    rate: float
+    elapsed: float
+
+
+class BroadcastQueueStats(NamedTuple):
+    """A class describing the numbers of scheduled updates in the broadcast queue by state"""
+
+    pending: int
+    retrying: int
+    sent: int
+    failed: int
+
+
+class SlotRange(NamedTuple):
+    """A class describing users whose scheduled updates are due: a range of location hashes in a time zone"""
+
+    start: float  # inclusive
+    end: float  # exclusive
+    aligned: bool  # whether the range only applies to users in the time zone below
+    utc_offset: int | None  # seconds, None for users whose time zone is not known yet
+
+
+class CacheStats(NamedTuple):
+    """A class describing the usage of a two-level cache"""
+
+    memory_hits: int
+    database_hits: int
+    misses: int
+
+
+class CoalescingStats(NamedTuple):
+    """A class describing the sharing of identical requests"""
+
+    calls: int  # requests actually made
+    coalesced: int  # requests that waited for an identical request in flight
+    reused: int  # requests answered by a recent response
+
+
+class RefreshPlan(NamedTuple):
+    """A class describing the decision of the quota governor about a scheduled weather update"""
+
+    run: bool
+    interval: int  # hours between scheduled updates of the same user
+    precision: int | None  # decimal places of the coordinates by which users are grouped, None for exact match
+    locations: int
+    projected: int  # requests expected by the end of the month
@@ -1,27 +1,79 @@
 """ Model describing the work with the database """
 
+from asyncio import Queue
+from contextlib import asynccontextmanager
 from datetime import datetime
-from sqlite3 import OperationalError
+from sqlite3 import OperationalError, Row
 from sys import exit as sys_exit
+from typing import AsyncIterator
+from zlib import crc32
 
-from aiosqlite import connect
+from aiosqlite import Connection, connect
 
 from tgbot.config import DB_FILE
 from tgbot.misc.logger import logger
 from tgbot.services.classes import User, UserWeatherSettings
 
 
+def get_location_hash(latitude: float | None, longitude: float | None) -> int | None:
+    """Returns the hash of the area of about 10 km around the coordinates, it sets the shard and the time of updates"""
+    if latitude is None or longitude is None:
+        return None
+    return crc32(f"{round(latitude, 1)}:{round(longitude, 1)}".encode())
+
+
+def get_user(row: Row) -> User:
+    """Returns the user from the row: id, dialog_id, lang, city, latitude, longitude, units, utc_offset"""
+    return User(
+        id=row[0],
+        dialog_id=row[1],
+        settings=UserWeatherSettings(lang=row[2], city=row[3], latitude=row[4], longitude=row[5], units=row[6]),
+        utc_offset=row[7],
+    )
+
+
 class Database:
     """A class for working with the database"""
 
+    _POOL_SIZE: int = 4
+    _CACHED_STATEMENTS: int = 256  # prepared statements kept by each connection, the sqlite3 default is 128
+    _BUSY_TIMEOUT_MS: int = 5000
+
     def __init__(self, path: str) -> None:
         """Defines the path to the database file"""
         self._db_path = path
+        self._pool: Queue[Connection] = Queue()
+        self._connections: list[Connection] = []
+        self._pending_api_requests: dict[str, int] = {}  # requests not yet saved in the database, by month
+
+    async def _open_connection(self) -> Connection:
+        """Opens a long-lived connection configured for concurrent access"""
+        db: Connection = await connect(database=self._db_path, cached_statements=self._CACHED_STATEMENTS)
+        await db.execute("""PRAGMA journal_mode=WAL;""")
+        await db.execute("""PRAGMA synchronous=NORMAL;""")
+        await db.execute(f"""PRAGMA busy_timeout={self._BUSY_TIMEOUT_MS};""")
+        return db
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Connection]:
+        """Takes a connection from the pool and returns it back after use"""
+        db: Connection = await self._pool.get()
+        try:
+            yield db
+        except BaseException:
+            await db.rollback()
+            raise
+        finally:
+            self._pool.put_nowait(db)
 
     async def init(self) -> None:
-        """Creates a database file and a table in it"""
+        """Creates a database file and a table in it, opens the connection pool"""
         try:
-            async with connect(database=self._db_path) as db:
+            for _ in range(self._POOL_SIZE - len(self._connections)):
+                db: Connection = await self._open_connection()
+                self._connections.append(db)
+                self._pool.put_nowait(db)
+            async with self.acquire() as db:
                 await db.execute(
                     """
                     CREATE TABLE IF NOT EXISTS users (
@@ -31,10 +83,29 @@ class Database:
                         city VARCHAR(72),
                         latitude REAL,
                         longitude REAL,
-                        units VARCHAR(8)
+                        units VARCHAR(8),
+                        utc_offset INTEGER,
+                        location_hash INTEGER
                     );
                     """
                 )
+                async with db.execute("""SELECT name FROM pragma_table_info('users');""") as cursor:
+                    columns: list[str] = [row[0] async for row in cursor]
+                if "utc_offset" not in columns:
+                    await db.execute("""ALTER TABLE users ADD COLUMN utc_offset INTEGER;""")
+                if "location_hash" not in columns:
+                    await db.execute("""ALTER TABLE users ADD COLUMN location_hash INTEGER;""")
+                    await db.create_function("location_hash", 2, get_location_hash, deterministic=True)
+                    await db.execute("""UPDATE users SET location_hash=location_hash(latitude, longitude);""")
+                await db.execute(
+                    """CREATE INDEX IF NOT EXISTS users_by_slot ON users (location_hash) WHERE units NOT NULL;"""
+                )
+                await db.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS users_by_morning_slot ON users (utc_offset, location_hash)
+                    WHERE units NOT NULL;
+                    """
+                )
                 await db.execute(
                     """
                     CREATE TABLE IF NOT EXISTS api_request_counters (
@@ -43,13 +114,86 @@ class Database:
                     );
                     """
                 )
+                await db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS media_files (
+                        name VARCHAR(128) PRIMARY KEY,
+                        file_id VARCHAR(256) NOT NULL
+                    );
+                    """
+                )
+                await db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS geocoding_cache (
+                        key VARCHAR(128) PRIMARY KEY,
+                        cities TEXT NOT NULL,
+                        created REAL NOT NULL
+                    );
+                    """
+                )
+                await db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS broadcast_workers (
+                        owner VARCHAR(128) PRIMARY KEY,
+                        expires REAL NOT NULL
+                    );
+                    """
+                )
+                await db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS broadcast_shards (
+                        shard INTEGER PRIMARY KEY,
+                        owner VARCHAR(128) NOT NULL DEFAULT '',
+                        expires REAL NOT NULL DEFAULT 0,
+                        processed_until REAL NOT NULL
+                    );
+                    """
+                )
+                await db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS broadcast_queue (
+                        user_id INTEGER PRIMARY KEY,
+                        shard INTEGER NOT NULL,
+                        state VARCHAR(8) NOT NULL,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        retry_at REAL NOT NULL,
+                        created REAL NOT NULL,
+                        location_hash INTEGER NOT NULL
+                    );
+                    """
+                )
+                await db.execute(
+                    """CREATE INDEX IF NOT EXISTS due_broadcasts ON broadcast_queue (shard, state, location_hash);"""
+                )
+                await db.execute("""CREATE INDEX IF NOT EXISTS broadcasts_by_time ON broadcast_queue (created);""")
+                await db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS fsm_states (
+                        chat_id INTEGER NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        state VARCHAR(128),
+                        data TEXT NOT NULL DEFAULT '{}',
+                        bucket TEXT NOT NULL DEFAULT '{}',
+                        PRIMARY KEY (chat_id, user_id)
+                    );
+                    """
+                )
+                await db.commit()
         except OperationalError as ex:
             logger.critical("Database connection error: %s", ex)
             sys_exit()
 
+    async def close(self) -> None:
+        """Saves pending counters and closes all connections of the pool"""
+        if self._connections:
+            await self.flush_api_counter()
+        while self._connections:
+            await self._connections.pop().close()
+        self._pool = Queue()
+
     async def save_dialog_id(self, user_id: int, dialog_id: int) -> None:
         """Saves the identifier of the dialog message with the user in the database"""
-        async with connect(database=self._db_path) as db:
+        async with self.acquire() as db:
             await db.execute(
                 """
                 INSERT INTO users (id, dialog_id) VALUES (?, ?)
@@ -61,22 +205,31 @@ class Database:
 
     async def save_city_coords(self, user_id: int, city: str, latitude: float, longitude: float) -> None:
         """Saves the coordinates of the selected city in the database"""
-        async with connect(database=self._db_path) as db:
+        async with self.acquire() as db:
             await db.execute(
-                """UPDATE users SET city=?, latitude=?, longitude=? WHERE id=?;""", (city, latitude, longitude, user_id)
+                """UPDATE users SET city=?, latitude=?, longitude=?, location_hash=? WHERE id=?;""",
+                (city, latitude, longitude, get_location_hash(latitude=latitude, longitude=longitude), user_id),
             )
             await db.commit()
 
     async def save_user_settings(self, user_id: int, lang_code: str, measure_units: str) -> None:
         """Saves the user's weather settings in the database"""
-        async with connect(database=self._db_path) as db:
+        async with self.acquire() as db:
             await db.execute("""UPDATE users SET lang=?, units=? WHERE id=?;""", (lang_code, measure_units, user_id))
             await db.commit()
 
+    async def save_utc_offset(self, user_ids: list[int], utc_offset: int) -> None:
+        """Saves the time zone of the users' city in the database"""
+        async with self.acquire() as db:
+            await db.executemany(
+                """UPDATE users SET utc_offset=? WHERE id=?;""", [(utc_offset, user_id) for user_id in user_ids]
+            )
+            await db.commit()
+
     async def get_dialog_id_if_exists(self, user_id: int) -> int | None:
         """Returns the id of the dialog message with the user from the database"""
         dialog_id: int | None = None
-        async with connect(database=self._db_path) as db:
+        async with self.acquire() as db:
             async with db.execute("""SELECT dialog_id FROM users WHERE id=?;""", (user_id,)) as cursor:
                 async for row in cursor:
                     dialog_id = row[0]
@@ -84,7 +237,7 @@ class Database:
 
     async def get_user_settings(self, user_id: int) -> UserWeatherSettings:
         """Returns the user's weather settings"""
-        async with connect(database=self._db_path) as db:
+        async with self.acquire() as db:
             async with db.execute(
                 """SELECT lang, city, latitude, longitude, units FROM users WHERE id=?;""", (user_id,)
             ) as cursor:
@@ -94,25 +247,31 @@ class Database:
                     )
         return user_weather_settings
 
-    async def get_list_all_users(self) -> list[User]:
-        """Returns the list of all users"""
-        users: list[User] = []
-        async with connect(database=self._db_path) as db:
-            async with db.execute("""SELECT id, dialog_id FROM users WHERE units NOT NULL;""") as cursor:
+    async def get_number_of_locations(self, precision: int | None = None) -> int:
+        """Returns the number of distinct locations of users, the coordinates are rounded to the decimal places"""
+        coordinates: str = "latitude, longitude"
+        if precision is not None:
+            coordinates = f"ROUND(latitude, {int(precision)}), ROUND(longitude, {int(precision)})"
+        counter: int = 0
+        async with self.acquire() as db:
+            async with db.execute(
+                f"""SELECT COUNT() FROM (SELECT DISTINCT {coordinates} FROM users WHERE units NOT NULL);"""
+            ) as cursor:
                 async for row in cursor:
-                    users.append(User(id=row[0], dialog_id=row[1]))
-        return users
+                    counter = row[0]
+        return counter
 
     async def delete_user(self, user_id: int) -> None:
         """Deletes a user from the database"""
-        async with connect(database=self._db_path) as db:
+        async with self.acquire() as db:
             await db.execute("""DELETE FROM users WHERE id=?;""", (user_id,))
+            await db.execute("""DELETE FROM broadcast_queue WHERE user_id=?;""", (user_id,))
             await db.commit()
 
     async def get_number_of_users(self) -> int:
         """Returns the number of users in the database"""
         counter: int = 0
-        async with connect(database=self._db_path) as db:
+        async with self.acquire() as db:
             async with db.execute("""SELECT COUNT() FROM users;""") as cursor:
                 async for row in cursor:
                     counter = row[0]
@@ -120,26 +279,65 @@ class Database:
 
     async def get_api_counter_value(self) -> int:
         """Returns the number of requests to OpenWeatherAPI made since the beginning of the month"""
+        month: str = datetime.now().strftime("%Y.%m")
         counter: int = 0
-        async with connect(database=self._db_path) as db:
-            async with db.execute(
-                """SELECT counter FROM api_request_counters WHERE month=?;""", (datetime.now().strftime("%Y.%m"),)
-            ) as cursor:
+        async with self.acquire() as db:
+            async with db.execute("""SELECT counter FROM api_request_counters WHERE month=?;""", (month,)) as cursor:
                 async for row in cursor:
                     counter = row[0]
-        return counter
+        return counter + self._pending_api_requests.get(month, 0)
 
-    async def increase_api_counter(self) -> None:
-        """Increases OpenWeatherMap API request counter value"""
-        async with connect(database=self._db_path) as db:
+    def increase_api_counter(self) -> None:
+        """Increases OpenWeatherMap API request counter value in memory, it is saved by flush_api_counter"""
+        month: str = datetime.now().strftime("%Y.%m")
+        self._pending_api_requests[month] = self._pending_api_requests.get(month, 0) + 1
+
+    async def flush_api_counter(self) -> None:
+        """Saves the accumulated OpenWeatherMap API request counter values in the database"""
+        if not self._pending_api_requests:
+            return
+        pending, self._pending_api_requests = self._pending_api_requests, {}
+        try:
+            async with self.acquire() as db:
+                await db.executemany(
+                    """
+                    INSERT INTO api_request_counters (month, counter) VALUES (?, ?)
+                    ON CONFLICT (month) DO UPDATE SET counter=counter+excluded.counter;
+                    """,
+                    pending.items(),
+                )
+                await db.commit()
+        except OperationalError as ex:
+            logger.error("Failed to save API request counters: %s", ex)
+            for month, counter in pending.items():
+                self._pending_api_requests[month] = self._pending_api_requests.get(month, 0) + counter
+
+    async def get_media_file_ids(self) -> dict[str, str]:
+        """Returns Telegram file_id of uploaded static files by their names"""
+        file_ids: dict[str, str] = {}
+        async with self.acquire() as db:
+            async with db.execute("""SELECT name, file_id FROM media_files;""") as cursor:
+                async for row in cursor:
+                    file_ids[row[0]] = row[1]
+        return file_ids
+
+    async def save_media_file_id(self, name: str, file_id: str) -> None:
+        """Saves Telegram file_id of the uploaded static file"""
+        async with self.acquire() as db:
             await db.execute(
                 """
-                INSERT INTO api_request_counters (month, counter) VALUES (?, ?)
-                ON CONFLICT (month) DO UPDATE SET counter=counter+1;
+                INSERT INTO media_files (name, file_id) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET file_id=excluded.file_id;
                 """,
-                (datetime.now().strftime("%Y.%m"), 1),
+                (name, file_id),
             )
             await db.commit()
 
+    async def delete_media_file_id(self, name: str) -> None:
+        """Deletes Telegram file_id of the static file"""
+        async with self.acquire() as db:
+            await db.execute("""DELETE FROM media_files WHERE name=?;""", (name,))
+            await db.commit()
+
 
 database: Database = Database(path=DB_FILE)
@@ -1,12 +1,77 @@
 """Formats weather data into the required view"""
 
-from math import log
+from typing import Callable
 
 from tgbot.middlewares.localization import i18n
 from tgbot.services.classes import CurrentWeatherData
 
 
 _ = i18n.gettext  # Alias for gettext method
+N_: Callable[[str], str] = str  # Marks the message for extraction into the catalogs, it is translated when used
+
+WEATHER_DESCRIPTIONS: dict[int, str] = {  # descriptions of weather codes from OpenWeatherMap
+    # thunderstorm
+    200: N_("thunderstorm with light rain"),
+    201: N_("thunderstorm with rain"),
+    202: N_("thunderstorm with heavy rain"),
+    210: N_("light thunderstorm"),
+    211: N_("thunderstorm"),
+    212: N_("heavy thunderstorm"),
+    221: N_("ragged thunderstorm"),
+    230: N_("thunderstorm with light drizzle"),
+    231: N_("thunderstorm with drizzle"),
+    232: N_("thunderstorm with heavy drizzle"),
+    # drizzle
+    300: N_("light intensity drizzle"),
+    301: N_("drizzle"),
+    302: N_("heavy intensity drizzle"),
+    310: N_("light intensity drizzle rain"),
+    311: N_("drizzle rain"),
+    312: N_("heavy intensity drizzle rain"),
+    313: N_("shower rain and drizzle"),
+    314: N_("heavy shower rain and drizzle"),
+    321: N_("shower drizzle"),
+    # rain
+    500: N_("light rain"),
+    501: N_("moderate rain"),
+    502: N_("heavy intensity rain"),
+    503: N_("very heavy rain"),
+    504: N_("extreme rain"),
+    511: N_("freezing rain"),
+    520: N_("light intensity shower rain"),
+    521: N_("shower rain"),
+    522: N_("heavy intensity shower rain"),
+    531: N_("ragged shower rain"),
+    # snow
+    600: N_("light snow"),
+    601: N_("snow"),
+    602: N_("heavy snow"),
+    611: N_("sleet"),
+    612: N_("light shower sleet"),
+    613: N_("shower sleet"),
+    615: N_("light rain and snow"),
+    616: N_("rain and snow"),
+    620: N_("light shower snow"),
+    621: N_("shower snow"),
+    622: N_("heavy shower snow"),
+    # atmosphere
+    701: N_("mist"),
+    711: N_("smoke"),
+    721: N_("haze"),
+    731: N_("sand/dust whirls"),
+    741: N_("fog"),
+    751: N_("sand"),
+    761: N_("dust"),
+    762: N_("volcanic ash"),
+    771: N_("squalls"),
+    781: N_("tornado"),
+    # clouds
+    800: N_("clear sky"),
+    801: N_("few clouds"),
+    802: N_("scattered clouds"),
+    803: N_("broken clouds"),
+    804: N_("overcast clouds"),
+}
 
 
 class FormatWeather:
@@ -50,24 +115,21 @@ class FormatWeather:
         return weather_emoji
 
     @staticmethod
-    async def _calculate_dew_point(temp: int, humidity: int) -> int:
-        """Calculates the surface temperature at which condensation occurs (dew point)"""
-        const_a: float = 17.27
-        const_b: float = 237.7
-
-        def func():  # type: ignore
-            return (const_a * temp) / (const_b + temp) + log(humidity / 100)
-
-        return round((const_b * func()) / (const_a - func()))  # type: ignore
+    async def _get_weather_description(weather_data: CurrentWeatherData, lang_code: str) -> str:
+        """Returns the description of the weather in the user's language by weather code from OpenWeatherMap"""
+        if weather_data.weather_code not in WEATHER_DESCRIPTIONS:  # the weather is fetched in English
+            return weather_data.weather_description
+        description: str = _(WEATHER_DESCRIPTIONS[weather_data.weather_code], locale=lang_code)
+        return description
 
     async def format_current_weather(
         self, weather_data: CurrentWeatherData, units: str, city: str, lang_code: str
     ) -> str:
-        """Returns the current weather data in the desired form"""
+        """Returns the current weather data, already converted to the units of the user, in the desired form"""
         emoji = await self._get_weather_emoji(weather=weather_data.weather_code)
+        description: str = await self._get_weather_description(weather_data=weather_data, lang_code=lang_code)
         temp_units: str = "°C" if units == "metric" else "°F"
         wind_units: str = "m/s" if units == "metric" else "mph"
-        dew_point: int = await self._calculate_dew_point(temp=weather_data.temp, humidity=weather_data.humidity)
 
         if weather_data.precipitation:
             precipitation: str = (
@@ -81,7 +143,7 @@ class FormatWeather:
             wind_gust = ""
         current_weather: str = (
             f"<b>{city}, {weather_data.time}</b>\n"
-            + f"{emoji} {weather_data.weather_description}{precipitation}\n\n"
+            + f"{emoji} {description}{precipitation}\n\n"
             + f"🌡 <b>{weather_data.temp}{temp_units}</b>, "
             + _("feels like", locale=lang_code)
             + f" <b>{weather_data.feels_like}{temp_units}</b>\n\n"
@@ -89,7 +151,7 @@ class FormatWeather:
             + _("Humidity", locale=lang_code)
             + f": <b>{weather_data.humidity}%</b>, "
             + _("Dew point", locale=lang_code)
-            + f": <b>{dew_point}{temp_units}</b>\n"
+            + f": <b>{weather_data.dew_point}{temp_units}</b>\n"
             + "💨 "
             + _("Wind speed", locale=lang_code)
             + f": <b>{weather_data.wind_speed} {wind_units}</b>{wind_gust}\n"
@@ -0,0 +1,117 @@
+"""Storage of the dialog states in the database, shared by all bot processes"""
+
+from json import dumps, loads
+from typing import Any
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from tgbot.services.database import Database, database
+
+
+class DatabaseStorage(BaseStorage):
+    """FSM storage in the database, the dialog of a user goes on in any process that receives the next update"""
+
+    def __init__(self, db: Database) -> None:
+        """Uses the connections of the database"""
+        self._database = db
+
+    async def close(self) -> None:
+        """Does nothing, the connections are closed together with the database"""
+
+    async def wait_closed(self) -> None:
+        """Does nothing, the connections are closed together with the database"""
+
+    async def _get(self, chat: str | int | None, user: str | int | None, field: str) -> Any:
+        """Returns the state, the data or the bucket of the user in the chat, None if it is not saved"""
+        chat, user = self.check_address(chat=chat, user=user)
+        value: Any = None
+        async with self._database.acquire() as db:
+            async with db.execute(
+                f"""SELECT {field} FROM fsm_states WHERE chat_id=? AND user_id=?;""", (chat, user)
+            ) as cursor:
+                async for row in cursor:
+                    value = row[0]
+        return value if value is None or field == "state" else loads(value)
+
+    async def _set(self, chat: str | int | None, user: str | int | None, field: str, value: Any) -> None:
+        """Saves the state, the data or the bucket of the user in the chat, the record is deleted when all are empty"""
+        chat, user = self.check_address(chat=chat, user=user)
+        if field != "state":
+            value = dumps(value or {})
+        async with self._database.acquire() as db:
+            await db.execute(
+                f"""
+                INSERT INTO fsm_states (chat_id, user_id, {field}) VALUES (?, ?, ?)
+                ON CONFLICT (chat_id, user_id) DO UPDATE SET {field}=excluded.{field};
+                """,
+                (chat, user, value),
+            )
+            await db.execute(
+                """
+                DELETE FROM fsm_states WHERE chat_id=? AND user_id=? AND state IS NULL AND data='{}' AND bucket='{}';
+                """,
+                (chat, user),
+            )
+            await db.commit()
+
+    async def get_state(
+        self, *, chat: str | int | None = None, user: str | int | None = None, default: str | None = None
+    ) -> str | None:
+        """Returns the state of the user in the chat"""
+        state: str | None = await self._get(chat=chat, user=user, field="state")
+        return state or self.resolve_state(default)
+
+    async def set_state(
+        self, *, chat: str | int | None = None, user: str | int | None = None, state: str | None = None
+    ) -> None:
+        """Saves the state of the user in the chat"""
+        await self._set(chat=chat, user=user, field="state", value=self.resolve_state(state))
+
+    async def get_data(
+        self, *, chat: str | int | None = None, user: str | int | None = None, default: dict | None = None
+    ) -> dict:
+        """Returns the data of the user in the chat"""
+        data: dict | None = await self._get(chat=chat, user=user, field="data")
+        return data or default or {}
+
+    async def set_data(
+        self, *, chat: str | int | None = None, user: str | int | None = None, data: dict | None = None
+    ) -> None:
+        """Saves the data of the user in the chat"""
+        await self._set(chat=chat, user=user, field="data", value=data)
+
+    async def update_data(
+        self, *, chat: str | int | None = None, user: str | int | None = None, data: dict | None = None, **kwargs: Any
+    ) -> None:
+        """Adds the values to the data of the user in the chat"""
+        saved: dict = await self.get_data(chat=chat, user=user)
+        saved.update(data or {}, **kwargs)
+        await self.set_data(chat=chat, user=user, data=saved)
+
+    def has_bucket(self) -> bool:
+        """Buckets are stored next to the state"""
+        return True
+
+    async def get_bucket(
+        self, *, chat: str | int | None = None, user: str | int | None = None, default: dict | None = None
+    ) -> dict:
+        """Returns the bucket of the user in the chat"""
+        bucket: dict | None = await self._get(chat=chat, user=user, field="bucket")
+        return bucket or default or {}
+
+    async def set_bucket(
+        self, *, chat: str | int | None = None, user: str | int | None = None, bucket: dict | None = None
+    ) -> None:
+        """Saves the bucket of the user in the chat"""
+        await self._set(chat=chat, user=user, field="bucket", value=bucket)
+
+    async def update_bucket(
+        self, *, chat: str | int | None = None, user: str | int | None = None, bucket: dict | None = None, **kwargs: Any
+    ) -> None:
+        """Adds the values to the bucket of the user in the chat"""
+        saved: dict = await self.get_bucket(chat=chat, user=user)
+        saved.update(bucket or {}, **kwargs)
+        await self.set_bucket(chat=chat, user=user, bucket=saved)
+
+
+fsm_storage: DatabaseStorage = DatabaseStorage(db=database)
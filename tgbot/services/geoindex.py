@@ -0,0 +1,193 @@
+"""Search for the nearest cities by coordinates in a local GeoNames dump"""
+
+from array import array
+from asyncio import to_thread
+from math import asin, ceil, cos, floor, pi, radians, sin, sqrt
+from time import perf_counter
+
+from tgbot.config import OfflineGeocodingSettings
+from tgbot.middlewares.localization import i18n
+from tgbot.misc.logger import logger
+from tgbot.services.classes import CityData
+
+
+class CityIndex:
+    """Cities from a GeoNames dump grouped into cells of one degree of latitude and longitude"""
+
+    _MAX_DISTANCE_KM: float = 300.0  # farther cities are not offered
+    _DUMP_LANGUAGE: str = "en"  # names in the cities dump are English or transliterated
+    _EARTH_RADIUS_KM: float = 6371.0
+    _DEGREE_KM: float = 6371.0 * pi / 180  # length of one degree of latitude
+
+    def __init__(self) -> None:
+        """Creates an empty index, it is filled by the from_geonames method"""
+        self._names: list[str] = []
+        self._countries: list[str] = []
+        self._latitudes: array = array("d")
+        self._longitudes: array = array("d")
+        self._cells: dict[tuple[int, int], array] = {}
+        self._local_names: dict[str, dict[int, str]] = {}  # names of cities by their index, for each language
+
+    def __len__(self) -> int:
+        """Returns the number of cities in the index"""
+        return len(self._names)
+
+    @staticmethod
+    def _get_cell(latitude: float, longitude: float) -> tuple[int, int]:
+        """Returns the cell containing the point"""
+        return floor(latitude), floor(longitude) % 360
+
+    @classmethod
+    def from_geonames(cls, path: str, alternate_names_path: str = "", languages: tuple[str, ...] = ()) -> "CityIndex":
+        """
+        Reads a GeoNames dump: tab-separated id, name, latitude, longitude and country code of each city
+
+        :param path: path to the cities dump
+        :param alternate_names_path: path to the dump of alternate names, empty string if there is none
+        :param languages: languages in which the names of cities are needed, besides the language of the cities dump
+        :return: index of the cities
+        """
+        index: CityIndex = cls()
+        geoname_ids: dict[int, int] = {}  # index of the city by its GeoNames id
+        with open(path, mode="r", encoding="utf-8") as file:
+            for line in file:
+                fields: list[str] = line.split("\t")
+                if len(fields) < 9:
+                    continue
+                latitude, longitude = float(fields[4]), float(fields[5])
+                index._cells.setdefault(index._get_cell(latitude, longitude), array("I")).append(len(index._names))
+                geoname_ids[int(fields[0])] = len(index._names)
+                index._names.append(fields[1])
+                index._countries.append(fields[8])
+                index._latitudes.append(latitude)
+                index._longitudes.append(longitude)
+        index._local_names = {language: {} for language in languages if language != cls._DUMP_LANGUAGE}
+        if alternate_names_path:
+            index._read_alternate_names(path=alternate_names_path, geoname_ids=geoname_ids)
+        return index
+
+    def _read_alternate_names(self, path: str, geoname_ids: dict[int, int]) -> None:
+        """
+        Reads the names of the cities in the needed languages from a GeoNames alternate names dump: tab-separated id,
+        city id, language, name and flags of a preferred, short, colloquial and historic name,
+        a preferred name replaces the others, colloquial and historic names are skipped
+        """
+        preferred: set[tuple[str, int]] = set()  # language and index of the cities whose preferred name is read
+        with open(path, mode="r", encoding="utf-8") as file:
+            for line in file:
+                fields: list[str] = line.rstrip("\n").split("\t")
+                if len(fields) < 4 or fields[2] not in self._local_names or "1" in fields[6:8]:
+                    continue
+                city_idx: int | None = geoname_ids.get(int(fields[1]))
+                if city_idx is None or (fields[2], city_idx) in preferred:
+                    continue
+                if fields[4:5] == ["1"]:
+                    preferred.add((fields[2], city_idx))
+                elif city_idx in self._local_names[fields[2]]:
+                    continue
+                self._local_names[fields[2]][city_idx] = fields[3]
+
+    def _get_distance(self, city_idx: int, latitude: float, longitude: float) -> float:
+        """Returns the great-circle distance from the city to the point in kilometers"""
+        lat_1, lat_2 = radians(self._latitudes[city_idx]), radians(latitude)
+        delta_lon: float = radians(self._longitudes[city_idx] - longitude)
+        hav: float = sin((lat_2 - lat_1) / 2) ** 2 + cos(lat_1) * cos(lat_2) * sin(delta_lon / 2) ** 2
+        return 2 * self._EARTH_RADIUS_KM * asin(sqrt(min(1.0, hav)))
+
+    def _get_ring_distance(self, ring: int, latitude: float) -> float:
+        """Returns the minimum distance in kilometers from a point to the cells outside the ring around its cell"""
+        lat_distance: float = ring * self._DEGREE_KM
+        if 2 * ring + 1 >= 360:  # the ring covers all longitudes
+            return lat_distance
+        lon_distance: float = self._EARTH_RADIUS_KM * asin(cos(radians(latitude)) * sin(radians(min(ring, 90))))
+        return min(lat_distance, lon_distance)
+
+    def _get_ring_cells(self, cell_lat: int, cell_lon: int, ring: int) -> list[tuple[int, int]]:
+        """Returns the cells of the ring around the cell, except those farther in latitude than the maximum distance"""
+        max_d_lat: int = min(ring, ceil(self._MAX_DISTANCE_KM / self._DEGREE_KM) + 1)
+        cells: set[tuple[int, int]] = set()  # cells of rings wider than 180 degrees of longitude coincide
+        for d_lat in range(-max_d_lat, max_d_lat + 1):
+            for d_lon in range(-ring, ring + 1) if abs(d_lat) == ring else (-ring, ring):
+                cells.add((cell_lat + d_lat, (cell_lon + d_lon) % 360))
+        return list(cells)
+
+    def find_nearest(
+        self, latitude: float, longitude: float, lang_code: str = _DUMP_LANGUAGE, limit: int = 5
+    ) -> list[CityData] | None:
+        """
+        Returns up to limit cities nearest to the point, searching the cells around it ring by ring
+
+        :param latitude: latitude of the point
+        :param longitude: longitude of the point
+        :param lang_code: ISO 639-1 language code, names from the cities dump are used for other than the read ones
+        :param limit: maximum number of cities
+        :return: list of CityData objects, or None if some of the cities have no name in the language
+        """
+        cell_lat, cell_lon = self._get_cell(latitude, longitude)
+        candidates: list[tuple[float, int]] = []
+        for ring in range(181):
+            for cell in self._get_ring_cells(cell_lat, cell_lon, ring):
+                candidates.extend(
+                    (self._get_distance(city_idx, latitude, longitude), city_idx)
+                    for city_idx in self._cells.get(cell, ())
+                )
+            candidates.sort()
+            ring_distance: float = self._get_ring_distance(ring, latitude)
+            if ring_distance > self._MAX_DISTANCE_KM or (
+                len(candidates) >= limit and candidates[limit - 1][0] <= ring_distance
+            ):  # the cities outside the ring cannot be closer
+                break
+        candidates = [candidate for candidate in candidates[:limit] if candidate[0] <= self._MAX_DISTANCE_KM]
+        names: dict[int, str] | None = self._local_names.get(lang_code)
+        if names is None:
+            names = {city_idx: self._names[city_idx] for _, city_idx in candidates}
+        elif any(city_idx not in names for _, city_idx in candidates):
+            return None
+        return [
+            CityData(
+                name=names[city_idx],
+                full_name=f"{names[city_idx]}, {self._countries[city_idx]}",
+                latitude=round(self._latitudes[city_idx], 6),
+                longitude=round(self._longitudes[city_idx], 6),
+            )
+            for _, city_idx in candidates
+        ]
+
+
+class OfflineGeocoder:
+    """Finds cities by coordinates in the local index, if the index is enabled in the settings"""
+
+    def __init__(self, settings: OfflineGeocodingSettings) -> None:
+        """Creates a geocoder, the index is read by the load method"""
+        self._settings = settings
+        self._index: CityIndex | None = None
+
+    async def load(self) -> None:
+        """Reads the GeoNames dump in a separate thread"""
+        if not self._settings.geonames_file or self._index is not None:
+            return
+        started: float = perf_counter()
+        try:
+            self._index = await to_thread(
+                CityIndex.from_geonames,
+                self._settings.geonames_file,
+                self._settings.alternate_names_file,
+                tuple(i18n.available_locales),
+            )
+        except (OSError, ValueError) as ex:
+            logger.error("Failed to load the GeoNames dump, the cities will be searched online: %s", ex)
+            return
+        logger.info("Loaded %s cities from the GeoNames dump in %.2f s", len(self._index), perf_counter() - started)
+
+    def find_cities(self, latitude: float, longitude: float, lang_code: str) -> list[CityData] | None:
+        """Returns the nearest cities named in the user's language, or None if they should be requested online"""
+        if self._index is None:
+            return None
+        cities: list[CityData] | None = self._index.find_nearest(
+            latitude=latitude, longitude=longitude, lang_code=lang_code
+        )
+        if not cities and self._settings.fallback_to_api:
+            return None  # there is no city nearby or some of them have no name in the user's language
+        if cities is None:
+            cities = self._index.find_nearest(latitude=latitude, longitude=longitude)
+        return cities
@@ -0,0 +1,123 @@
+"""Long-lived pooled HTTP client for requests to external APIs"""
+
+from asyncio import sleep, TimeoutError as AsyncioTimeoutError
+from random import uniform
+from types import SimpleNamespace
+from typing import Any, Callable
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector, TraceConfig
+
+from tgbot.config import HttpClientSettings
+from tgbot.services.breaker import CircuitBreaker, CircuitOpenError
+from tgbot.services.classes import HttpPoolStats
+
+
+class HttpClient:
+    """Keeps one aiohttp session with a keep-alive connection pool, retries failed requests and counts its usage"""
+
+    def __init__(self, on_request: Callable[[], None] | None = None) -> None:
+        """Creates a closed client, the session is opened by the open method, on_request is called for every attempt"""
+        self._on_request = on_request
+        self._session: ClientSession | None = None
+        self._settings: HttpClientSettings | None = None
+        self._breakers: dict[str, CircuitBreaker] = {}  # by endpoint
+        self._counters: dict[str, int] = dict.fromkeys(HttpPoolStats._fields, 0)
+
+    def _create_trace_config(self) -> TraceConfig:
+        """Creates hooks that count new and reused connections and DNS cache usage"""
+        trace_config: TraceConfig = TraceConfig()
+
+        def count(field: str) -> Any:
+            """Returns a trace callback that increments the specified counter"""
+
+            async def callback(_session: ClientSession, _context: SimpleNamespace, _params: Any) -> None:
+                self._counters[field] += 1
+
+            return callback
+
+        trace_config.on_request_start.append(count("requests"))
+        trace_config.on_connection_create_end.append(count("connections_created"))
+        trace_config.on_connection_reuseconn.append(count("connections_reused"))
+        trace_config.on_dns_cache_hit.append(count("dns_cache_hits"))
+        trace_config.on_dns_cache_miss.append(count("dns_cache_misses"))
+        return trace_config
+
+    async def open(self, settings: HttpClientSettings) -> None:
+        """Opens the session with the connection pool"""
+        if self._session is not None:
+            return
+        self._settings = settings
+        self._session = ClientSession(
+            connector=TCPConnector(
+                limit_per_host=settings.limit_per_host,
+                keepalive_timeout=settings.keepalive_timeout,
+                ttl_dns_cache=settings.dns_cache_ttl,
+            ),
+            timeout=ClientTimeout(total=settings.total_timeout, connect=settings.connect_timeout),
+            trace_configs=[self._create_trace_config()],
+        )
+
+    async def close(self) -> None:
+        """Closes the session and all pooled connections"""
+        if self._session is None:
+            return
+        await self._session.close()
+        self._session = None
+
+    @property
+    def stats(self) -> HttpPoolStats:
+        """Returns the connection pool statistics"""
+        return HttpPoolStats(**self._counters)
+
+    @staticmethod
+    def _get_endpoint(url: str) -> str:
+        """Returns the URL without the query string"""
+        return url.partition("?")[0]
+
+    def is_available(self, url: str) -> bool:
+        """Checks that requests to the endpoint of the URL are not stopped after failures"""
+        breaker: CircuitBreaker | None = self._breakers.get(self._get_endpoint(url=url))
+        return breaker is None or not breaker.is_open
+
+    async def get_json(self, url: str) -> tuple[int, Any]:
+        """
+        Makes a GET request and returns the response status and the decoded JSON body,
+        connection errors, timeouts and responses 429 and 5xx are retried after random growing delays
+
+        :param url: URL of the request
+        :return: status and decoded body of the last response
+        :raises CircuitOpenError: if requests to the endpoint are stopped after failures
+        """
+        if self._session is None or self._settings is None:
+            raise RuntimeError("HTTP client is not opened")
+        endpoint: str = self._get_endpoint(url=url)
+        if endpoint not in self._breakers:
+            self._breakers[endpoint] = CircuitBreaker(
+                name=endpoint,
+                failure_threshold=self._settings.breaker_threshold,
+                reset_timeout=self._settings.breaker_reset_timeout,
+            )
+        breaker: CircuitBreaker = self._breakers[endpoint]
+        attempt: int = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(endpoint)
+            if self._on_request is not None:
+                self._on_request()  # a failed or timed out attempt may also have reached the server
+            try:
+                async with self._session.get(url=url) as response:
+                    status: int = response.status
+                    result: Any = await response.json()
+            except (ClientError, AsyncioTimeoutError):  # on Python 3.10 it is not the builtin TimeoutError
+                breaker.record_failure()
+                if attempt == self._settings.retries:
+                    raise
+            else:
+                if status < 500 and status != 429:
+                    breaker.record_success()
+                    return status, result
+                breaker.record_failure()
+                if attempt == self._settings.retries:
+                    return status, result
+            attempt += 1
+            await sleep(uniform(0, self._settings.retry_delay * 2 ** (attempt - 1)))
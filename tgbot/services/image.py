@@ -1,12 +1,18 @@
 """Generates an image with weather forecast information"""
 
+from asyncio import Semaphore, get_running_loop
+from bisect import bisect_right
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
-from os import makedirs, path
+from functools import cache, lru_cache
+from io import BytesIO
+from multiprocessing import get_context
+from os import path
+from typing import NamedTuple
 
 from PIL import Image, ImageDraw, ImageFont
-from PIL.PyAccess import PyAccess
 
-from tgbot.config import BASE_DIR
+from tgbot.config import BASE_DIR, RenderSettings
 from tgbot.services.classes import ForecastData
 
 
@@ -18,194 +24,232 @@ class Cursor:
     pos_y: int = 0
 
 
+class TextSprite(NamedTuple):
+    """Pre-rasterised text: its mask, the offset of the mask from the text position and the text length"""
+
+    mask: Image.Image
+    left: int
+    top: int
+    length: float
+
+
+class ColorScale(NamedTuple):
+    """Colors of the ranges of values, each range starts at its breakpoint, the first one covers everything below"""
+
+    breakpoints: tuple[int, ...]
+    fill: tuple[str, ...]  # colors of the column, one for each range
+    text: tuple[str, ...]  # colors of the text in the column
+
+    def get_colors(self, value: int) -> tuple[str, str]:
+        """Returns the colors of the column and its text for the value"""
+        idx: int = bisect_right(self.breakpoints, value)
+        return self.fill[idx], self.text[idx]
+
+
+TEMP_COLORS: ColorScale = ColorScale(  # °C
+    breakpoints=(-30, -20, -15, -10, -5, 0, 5, 10, 15, 20, 25, 30, 40, 50),
+    fill=(
+        "#e3e3e3",
+        "#f3a5f3",
+        "#8e108e",
+        "#291e6a",
+        "#5751ac",
+        "#4178be",
+        "#4db094",
+        "#5ac84b",
+        "#b8db41",
+        "#e1ce39",
+        "#e09f41",
+        "#db6c54",
+        "#b73466",
+        "#6b1527",
+        "#2b0001",
+    ),
+    text=("#000000",) * 2 + ("#FFFFFF",) * 4 + ("#000000",) * 5 + ("#FFFFFF",) * 4,
+)
+WIND_COLORS: ColorScale = ColorScale(  # m/s
+    breakpoints=tuple(range(10, 150, 10)),
+    fill=(
+        "#5a5673",
+        "#5258ab",
+        "#4083b8",
+        "#4ea98f",
+        "#4abe47",
+        "#8ec94b",
+        "#cad63e",
+        "#d8bf3d",
+        "#d69b44",
+        "#d5784c",
+        "#c7466f",
+        "#a3355b",
+        "#901c4f",
+        "#631a1b",
+        "#2b0001",
+    ),
+    text=("#FFFFFF",) * 4 + ("#000000",) * 6 + ("#FFFFFF",) * 5,
+)
+
+
 class DrawWeatherImage:
     """Draws an image with the weather forecast"""
 
     _ICONS_DIR: str = path.join(BASE_DIR, "tgbot/assets/ico")
     _FONT: str = path.join(BASE_DIR, "tgbot/assets/font/Rubik-Bold.ttf")
-    _TEMP_DIR: str = path.join(BASE_DIR, "tgbot/temp")
+    _ICON_CODES: tuple[str, ...] = tuple(
+        f"{code}{time_of_day}"
+        for code in ("01", "02", "03", "04", "09", "10", "11", "13", "50")
+        for time_of_day in ("d", "n")
+    )
 
     def __init__(self) -> None:
-        if not path.exists(self._TEMP_DIR):
-            makedirs(self._TEMP_DIR)
+        """Loads the weather icons into memory"""
+        self._icons: dict[str, Image.Image] = {}
+        self._inverted_icons: dict[str, Image.Image] = {}
+        for ico_code in self._ICON_CODES:
+            file_path: str = path.join(self._ICONS_DIR, f"{ico_code}.png")
+            with Image.open(fp=file_path, mode="r", formats=("PNG",)) as weather_icon:
+                self._icons[ico_code] = weather_icon.convert(mode="RGBA")
+            self._inverted_icons[ico_code] = self._invert_image_color(image=self._icons[ico_code])
 
     @staticmethod
-    def _get_temp_color(temperature: str) -> str:
-        """Returns the color code, depending on the temperature value"""
-        if temperature[-1:] == "C":
-            temp: int = int(temperature.removesuffix("°C"))
-        else:
-            temp = round((int(temperature.removesuffix("°F")) - 32) * (5 / 9))
-
-        if temp >= 50:
-            temp_color: str = "#2b0001"
-        elif 49 >= temp >= 40:
-            temp_color = "#6b1527"
-        elif 39 >= temp >= 30:
-            temp_color = "#b73466"
-        elif 29 >= temp >= 25:
-            temp_color = "#db6c54"
-        elif 24 >= temp >= 20:
-            temp_color = "#e09f41"
-        elif 19 >= temp >= 15:
-            temp_color = "#e1ce39"
-        elif 14 >= temp >= 10:
-            temp_color = "#b8db41"
-        elif 9 >= temp >= 5:
-            temp_color = "#5ac84b"
-        elif 4 >= temp >= 0:
-            temp_color = "#4db094"
-        elif -1 >= temp >= -5:
-            temp_color = "#4178be"
-        elif -6 >= temp >= -10:
-            temp_color = "#5751ac"
-        elif -11 >= temp >= -15:
-            temp_color = "#291e6a"
-        elif -16 >= temp >= -20:
-            temp_color = "#8e108e"
-        elif -21 >= temp >= -30:
-            temp_color = "#f3a5f3"
-        else:
-            temp_color = "#e3e3e3"
-        return temp_color
+    @cache
+    def _get_font(font_size: int) -> ImageFont.FreeTypeFont:
+        """Returns the font of the specified size, each size is loaded only once"""
+        return ImageFont.truetype(font=DrawWeatherImage._FONT, size=font_size)
 
     @staticmethod
-    def _get_wind_color(wind_speed: str) -> str:
-        """Returns the color code, depending on the wind speed value"""
-        if wind_speed[-1:] == "s":
-            speed: int = int(wind_speed.removesuffix(" m/s"))
-        else:
-            speed = round(float(wind_speed.removesuffix(" mph")) / 2.237)
-
-        if 0 <= speed <= 9:
-            wind_speed_color: str = "#5a5673"
-        elif 10 <= speed <= 19:
-            wind_speed_color = "#5258ab"
-        elif 20 <= speed <= 29:
-            wind_speed_color = "#4083b8"
-        elif 30 <= speed <= 39:
-            wind_speed_color = "#4ea98f"
-        elif 40 <= speed <= 49:
-            wind_speed_color = "#4abe47"
-        elif 50 <= speed <= 59:
-            wind_speed_color = "#8ec94b"
-        elif 60 <= speed <= 69:
-            wind_speed_color = "#cad63e"
-        elif 70 <= speed <= 79:
-            wind_speed_color = "#d8bf3d"
-        elif 80 <= speed <= 89:
-            wind_speed_color = "#d69b44"
-        elif 90 <= speed <= 99:
-            wind_speed_color = "#d5784c"
-        elif 100 <= speed <= 109:
-            wind_speed_color = "#c7466f"
-        elif 110 <= speed <= 119:
-            wind_speed_color = "#a3355b"
-        elif 120 <= speed <= 129:
-            wind_speed_color = "#901c4f"
-        elif 130 <= speed <= 139:
-            wind_speed_color = "#631a1b"
-        else:
-            wind_speed_color = "#2b0001"
-        return wind_speed_color
+    @lru_cache(maxsize=1024)
+    def _get_text_sprite(text: str, font_size: int) -> TextSprite:
+        """Rasterises the text once, the set of texts on the images is small: times, temperatures and wind speeds"""
+        font: ImageFont.FreeTypeFont = DrawWeatherImage._get_font(font_size=font_size)
+        left, top, right, bottom = font.getbbox(text=text)
+        mask: Image.Image = Image.new(mode="L", size=(right - left, bottom - top))
+        ImageDraw.Draw(im=mask).text(xy=(-left, -top), text=text, font=font, fill=255)
+        return TextSprite(mask=mask, left=left, top=top, length=font.getlength(text=text))
 
     @staticmethod
-    def _get_color_of_text_temperature(temperature: str) -> str:
-        """Returns the temperature text color code, depending on the temperature value"""
-        if temperature[-1:] == "C":
-            temp: int = int(temperature.removesuffix("°C"))
-        else:
-            temp = round((int(temperature.removesuffix("°F")) - 32) * (5 / 9))
-
-        if 24 >= temp >= 0 or temp <= -21:
-            return "#000000"
-        return "#FFFFFF"
+    def _get_temp_colors(temp: float, units: str) -> tuple[str, str]:
+        """Returns the colors of the temperature column and its text, the temperature is in the units of the user"""
+        return TEMP_COLORS.get_colors(value=round(temp) if units == "metric" else round((temp - 32) * 5 / 9))
 
     @staticmethod
-    def _get_color_of_text_wind(wind_speed: str) -> str:
-        """Returns the wind speed text color code, depending on the wind speed value"""
-        if wind_speed[-1:] == "s":
-            speed: int = int(wind_speed.removesuffix(" m/s"))
-        else:
-            speed = round(float(wind_speed.removesuffix(" mph")) / 2.237)
-
-        if 99 >= speed >= 40:
-            return "#000000"
-        return "#FFFFFF"
+    def _get_wind_colors(wind_speed: float, units: str) -> tuple[str, str]:
+        """Returns the colors of the wind speed column and its text, the speed is in the units of the user"""
+        return WIND_COLORS.get_colors(value=round(wind_speed) if units == "metric" else round(wind_speed / 2.237))
 
     @staticmethod
-    def _invert_image_color(image: Image) -> Image:
-        """Inverts the black color in the image"""
-        pixel_data: PyAccess | None = image.load()
-        size_x, size_y = image.size
-        for pos_y in range(size_y):
-            for pos_x in range(size_x):
-                if pixel_data:
-                    alpha = pixel_data[pos_x, pos_y][3]
-                    if alpha:
-                        pixel_data[pos_x, pos_y] = (255, 255, 255, alpha)
-        return image
-
-    def draw_image(self, data: ForecastData, user_id: int) -> str:
-        """Draws an image with weather forecast information"""
+    def _invert_image_color(image: Image.Image) -> Image.Image:
+        """Returns a copy of the image with the black color inverted, transparent pixels are kept as is"""
+        alpha: Image.Image = image.getchannel(channel="A")
+        white_image: Image.Image = Image.new(mode="RGBA", size=image.size, color="#FFFFFF")
+        white_image.putalpha(alpha)
+        return Image.composite(image1=white_image, image2=image, mask=alpha.point(lambda value: 255 if value else 0))
+
+    def draw_image(self, data: ForecastData, units: str) -> bytes:
+        """Draws an image with weather forecast data converted to the units and returns it encoded in PNG"""
         cursor: Cursor = Cursor()
         canvas: Image = Image.new(mode="RGBA", size=(799, 199), color="#262626")
         draw: ImageDraw = ImageDraw.Draw(im=canvas)
 
-        temp: list[str] = data.temp
-        time: list[str] = data.time
-        ico_code: list[str] = data.ico_code
-        wind_speed: list[str] = data.wind_speed
+        temp_units: str = "°C" if units == "metric" else "°F"
+        wind_units: str = "m/s" if units == "metric" else "mph"
 
         def draw_text_align_center(pos_x: int, pos_y: int, font_size: int, text: str, color: str) -> None:
             """Draws specified text with center alignment"""
-            font: ImageFont = ImageFont.truetype(font=self._FONT, size=font_size)
-            offset: int = round((99 - draw.textlength(text=text, font=font)) / 2)
-            draw.text(xy=(pos_x + offset, pos_y), text=text, font=font, fill=color)
+            sprite: TextSprite = self._get_text_sprite(text=text, font_size=font_size)
+            offset: int = round((99 - sprite.length) / 2)
+            canvas.paste(im=color, box=(pos_x + offset + sprite.left, pos_y + sprite.top), mask=sprite.mask)
 
         for idx in range(8):
             # fill temperature columns
+            column_color, color_of_text = self._get_temp_colors(temp=data.temp[idx], units=units)
             cursor.pos_y = 0
-            draw.rectangle(
-                xy=(cursor.pos_x, cursor.pos_y, cursor.pos_x + 98, cursor.pos_y + 163),
-                fill=self._get_temp_color(temperature=temp[idx]),
-            )
+            draw.rectangle(xy=(cursor.pos_x, cursor.pos_y, cursor.pos_x + 98, cursor.pos_y + 163), fill=column_color)
             # draw time
-            color_of_text: str = self._get_color_of_text_temperature(temperature=temp[idx])
             cursor.pos_y = 15
             draw_text_align_center(
-                pos_x=cursor.pos_x, pos_y=cursor.pos_y, font_size=24, text=time[idx], color=color_of_text
+                pos_x=cursor.pos_x, pos_y=cursor.pos_y, font_size=24, text=data.time[idx], color=color_of_text
             )
             # draw weather icons
             cursor.pos_y = 50
-            file_path: str = path.join(self._ICONS_DIR, f"{ico_code[idx]}.png")
-            weather_icon: Image = Image.open(fp=file_path, mode="r", formats=("PNG",))
-            if color_of_text == "#FFFFFF":
-                weather_icon = self._invert_image_color(image=weather_icon)
-            canvas.alpha_composite(im=weather_icon, dest=(cursor.pos_x + 17, cursor.pos_y))
-            weather_icon.close()
+            icons: dict[str, Image.Image] = self._inverted_icons if color_of_text == "#FFFFFF" else self._icons
+            canvas.alpha_composite(im=icons[data.ico_code[idx]], dest=(cursor.pos_x + 17, cursor.pos_y))
             # draw temperature
             cursor.pos_y = 126
             draw_text_align_center(
-                pos_x=cursor.pos_x, pos_y=cursor.pos_y, font_size=24, text=temp[idx], color=color_of_text
+                pos_x=cursor.pos_x,
+                pos_y=cursor.pos_y,
+                font_size=24,
+                text=f"{data.temp[idx]:.0f}{temp_units}",
+                color=color_of_text,
             )
             # fill wind speed columns
+            column_color, color_of_text = self._get_wind_colors(wind_speed=data.wind_speed[idx], units=units)
             cursor.pos_y = 165
-            draw.rectangle(
-                xy=(cursor.pos_x, cursor.pos_y, cursor.pos_x + 98, cursor.pos_y + 34),
-                fill=self._get_wind_color(wind_speed=wind_speed[idx]),
-            )
+            draw.rectangle(xy=(cursor.pos_x, cursor.pos_y, cursor.pos_x + 98, cursor.pos_y + 34), fill=column_color)
             # draw wind speed
-            color_of_text = self._get_color_of_text_wind(wind_speed=wind_speed[idx])
             cursor.pos_y = 173
             draw_text_align_center(
-                pos_x=cursor.pos_x, pos_y=cursor.pos_y, font_size=18, text=wind_speed[idx], color=color_of_text
+                pos_x=cursor.pos_x,
+                pos_y=cursor.pos_y,
+                font_size=18,
+                text=f"{data.wind_speed[idx]:.0f} {wind_units}",
+                color=color_of_text,
             )
             # shift to the next column
             cursor.pos_x += 100
 
-        path_to_image: str = path.join(self._TEMP_DIR, f"{user_id}.png")
-        canvas.save(fp=path_to_image, format="PNG")
+        image: BytesIO = BytesIO()
+        canvas.save(fp=image, format="PNG")
         canvas.close()
 
-        return path_to_image
+        return image.getvalue()
+
+
+@cache
+def _get_drawer() -> DrawWeatherImage:
+    """Returns the image drawer of the current worker process"""
+    return DrawWeatherImage()
+
+
+def _draw_image(data: ForecastData, units: str) -> bytes:
+    """Draws an image in an executor worker"""
+    return _get_drawer().draw_image(data=data, units=units)
+
+
+class ImageRenderer:
+    """Draws weather forecast images in a thread or process pool so as not to block the event loop"""
+
+    def __init__(self) -> None:
+        """Creates a stopped renderer, the pool is created by the start method"""
+        self._executor: Executor | None = None
+        self._in_flight: Semaphore | None = None
+
+    def start(self, settings: RenderSettings) -> None:
+        """Creates the pool of workers"""
+        if self._executor is not None:
+            return
+        if settings.executor == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=settings.workers, mp_context=get_context("spawn"), initializer=_get_drawer
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=settings.workers, thread_name_prefix="render")
+        self._in_flight = Semaphore(settings.max_in_flight)
+
+    def close(self) -> None:
+        """Waits for the images being drawn and stops the pool"""
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+
+    async def draw_image(self, data: ForecastData, units: str) -> bytes:
+        """Draws an image in the pool, waits if the maximum number of images is already being drawn"""
+        if self._executor is None or self._in_flight is None:
+            raise RuntimeError("Image renderer is not started")
+        async with self._in_flight:
+            return await get_running_loop().run_in_executor(self._executor, _draw_image, data, units)
+
+
+renderer: ImageRenderer = ImageRenderer()
@@ -0,0 +1,151 @@
+"""Sending of photos with reuse of files already uploaded to Telegram"""
+
+from asyncio import Lock
+from hashlib import sha256
+from io import BytesIO
+from os.path import relpath
+from typing import Any, Awaitable, Callable, cast
+
+from aiogram import Bot
+from aiogram.types import InputFile, InputMediaPhoto, Message
+from aiogram.utils.exceptions import TypeOfFileMismatch, WrongFileIdentifier, WrongRemoteFileIdSpecified
+
+from tgbot.config import BASE_DIR, BOT_LOGO
+from tgbot.misc.logger import logger
+from tgbot.services.classes import ForecastData, ForecastImage
+from tgbot.services.database import database
+from tgbot.services.image import renderer
+from tgbot.services.parser import ParseWeather
+
+
+class MediaRegistry:
+    """Uploads each static file to Telegram once and then sends it by file_id"""
+
+    def __init__(self) -> None:
+        """Creates an empty registry, saved file_id are read by the load method"""
+        self._file_ids: dict[str, str] = {}
+
+    async def load(self) -> None:
+        """Reads file_id of the previously uploaded files from the database"""
+        self._file_ids = await database.get_media_file_ids()
+
+    async def send_photo(self, bot: Bot, chat_id: int, path: str, **kwargs: Any) -> Message:
+        """Sends a static photo by file_id, uploads it if there is no file_id yet or Telegram rejected it"""
+        name: str = relpath(path, BASE_DIR)
+        file_id: str | None = self._file_ids.get(name)
+        if file_id:
+            try:
+                message: Message = await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+                return message
+            except (TypeOfFileMismatch, WrongFileIdentifier, WrongRemoteFileIdSpecified) as ex:
+                logger.warning("Telegram rejected file_id of %s, uploading it again: %s", name, ex)
+                del self._file_ids[name]
+                await database.delete_media_file_id(name=name)
+        message = await bot.send_photo(chat_id=chat_id, photo=InputFile(path), **kwargs)
+        self._file_ids[name] = message.photo[-1].file_id
+        await database.save_media_file_id(name=name, file_id=self._file_ids[name])
+        return message
+
+    async def send_forecast(self, bot: Bot, chat_id: int, forecast_image: bytes | None, **kwargs: Any) -> Message:
+        """Sends the weather forecast image, or the bot logo if there is no image"""
+        if forecast_image is None:
+            return await self.send_photo(bot=bot, chat_id=chat_id, path=BOT_LOGO, **kwargs)
+        message: Message = await bot.send_photo(
+            chat_id=chat_id, photo=InputFile(BytesIO(forecast_image), filename="forecast.png"), **kwargs
+        )
+        return message
+
+
+class ForecastImageCache:
+    """Forecast images of one broadcast, each distinct image is drawn and uploaded to Telegram only once"""
+
+    def __init__(self) -> None:
+        """Creates an empty cache, a new one is used for every broadcast"""
+        self._images: dict[str, ForecastImage] = {}
+        self._file_ids: dict[str, str] = {}
+        self._uploads: dict[str, Lock] = {}
+        self._drawings: dict[str, Lock] = {}
+        self._drawn: int = 0
+        self._uploaded: int = 0
+        self._parser = ParseWeather()
+
+    @staticmethod
+    def get_key(data: ForecastData, units: str) -> str:
+        """Returns the hash of the converted forecast content, equal forecasts give byte-identical images"""
+        return sha256(f"{units}:{data!r}".encode()).hexdigest()
+
+    async def get_image(self, data: ForecastData, units: str) -> ForecastImage:
+        """Returns the forecast image in the units, draws it only if an image with the same content is not drawn yet"""
+        converted: ForecastData = await self._parser.convert_weather_forecast(data=data, units=units)
+        key: str = self.get_key(data=converted, units=units)
+        async with self._drawings.setdefault(key, Lock()):  # the same image may be needed by several locations at once
+            if key not in self._images:
+                self._images[key] = ForecastImage(key=key, image=await renderer.draw_image(data=converted, units=units))
+                self._drawn += 1
+        return self._images[key]
+
+    def release_images(self) -> None:
+        """Forgets the drawn images, file_id of the uploaded ones are kept and used if the same image is needed again"""
+        self._images.clear()
+        self._drawings.clear()
+
+    async def _call_by_file_id(
+        self, key: str, method: Callable[[str | InputFile], Awaitable[Message]]
+    ) -> Message | None:
+        """Calls the method with file_id of the image if it has already been uploaded and Telegram accepts it"""
+        file_id: str | None = self._file_ids.get(key)
+        if file_id is None:
+            return None
+        try:
+            return await method(file_id)
+        except (TypeOfFileMismatch, WrongFileIdentifier, WrongRemoteFileIdSpecified) as ex:
+            logger.warning("Telegram rejected file_id of the forecast image, uploading it again: %s", ex)
+            self._file_ids.pop(key, None)
+            return None
+
+    async def _call_with_image(
+        self, forecast: ForecastImage, method: Callable[[str | InputFile], Awaitable[Message]]
+    ) -> Message:
+        """Calls the method with the image, it is uploaded by the first call and passed by file_id to the others"""
+        message: Message | None = await self._call_by_file_id(key=forecast.key, method=method)
+        if message:
+            return message
+        async with self._uploads.setdefault(forecast.key, Lock()):  # the others wait for the first upload
+            message = await self._call_by_file_id(key=forecast.key, method=method)
+            if message:
+                return message
+            message = await method(InputFile(BytesIO(forecast.image), filename="forecast.png"))
+            self._file_ids[forecast.key] = message.photo[-1].file_id
+            self._uploaded += 1
+            return message
+
+    async def send(self, bot: Bot, chat_id: int, forecast: ForecastImage | None, **kwargs: Any) -> Message:
+        """Sends the forecast image, it is uploaded by the first recipient and sent by file_id to the others"""
+        if forecast is None:
+            return await media.send_photo(bot=bot, chat_id=chat_id, path=BOT_LOGO, **kwargs)
+
+        async def send_photo(photo: str | InputFile) -> Message:
+            message: Message = await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+            return message
+
+        return await self._call_with_image(forecast=forecast, method=send_photo)
+
+    async def edit(self, bot: Bot, chat_id: int, forecast: ForecastImage, caption: str, **kwargs: Any) -> Message:
+        """Replaces the photo and the caption of the message sent by the bot (message_id) with the forecast image"""
+
+        async def edit_message_media(photo: str | InputFile) -> Message:
+            message: Message | bool = await bot.edit_message_media(
+                media=InputMediaPhoto(media=photo, caption=caption, parse_mode=bot.parse_mode),
+                chat_id=chat_id,
+                **kwargs,
+            )
+            return cast(Message, message)  # True is only returned for inline messages
+
+        return await self._call_with_image(forecast=forecast, method=edit_message_media)
+
+    def __str__(self) -> str:
+        """Returns the numbers of drawn and uploaded images"""
+        return f"{self._drawn} forecast images drawn, {self._uploaded} uploaded"
+
+
+media: MediaRegistry = MediaRegistry()
@@ -1,6 +1,8 @@
 """Parses raw data on weather with OpenWeatherAPI"""
 
+from array import array
 from datetime import datetime, timedelta
+from math import log
 
 from tzlocal import get_localzone
 
@@ -33,16 +35,34 @@ class ParseWeather:
             logger.error("Error when parsing city data: %s", ex)
         return None
 
+    @staticmethod
+    def _calculate_dew_point(temp: float, humidity: int) -> float:
+        """Calculates the surface temperature at which condensation occurs (dew point), in °C"""
+        const_a: float = 17.27
+        const_b: float = 237.7
+        gamma: float = (const_a * temp) / (const_b + temp) + log(humidity / 100)
+        return (const_b * gamma) / (const_a - gamma)
+
+    @staticmethod
+    def _convert_temperature(temp: float, units: str) -> int:
+        """Converts the temperature from °C to the units of the user and rounds it"""
+        return round(temp) if units == "metric" else round(temp * 9 / 5 + 32)
+
+    @staticmethod
+    def _convert_speed(speed: float, units: str) -> int:
+        """Converts the speed from m/s to the units of the user and rounds it"""
+        return round(speed) if units == "metric" else round(speed * 2.237)
+
     @staticmethod
     async def parse_current_weather(raw_data: dict) -> CurrentWeatherData | None:
-        """Parses current weather data from OpenWeatherAPI response"""
+        """Parses current weather data from OpenWeatherAPI response in metric units"""
         try:
-            temp: int = round(raw_data["main"]["temp"])
-            feels_like: int = round(raw_data["main"]["feels_like"])
+            temp: float = raw_data["main"]["temp"]
+            feels_like: float = raw_data["main"]["feels_like"]
             weather_code: int = raw_data["weather"][0]["id"]
             weather_description: str = raw_data["weather"][0]["description"]
-            wind_speed: int = round(raw_data["wind"]["speed"])
-            gust: int | None = round(raw_data["wind"]["gust"]) if raw_data["wind"].get("gust") else None
+            wind_speed: float = raw_data["wind"]["speed"]
+            gust: float | None = raw_data["wind"]["gust"] if raw_data["wind"].get("gust") else None
             humidity: int = raw_data["main"]["humidity"]
             pressure: int = raw_data["main"]["pressure"]
             visibility: float = round(raw_data["visibility"] / 1000, 1)
@@ -63,6 +83,7 @@ class ParseWeather:
             return CurrentWeatherData(
                 temp=temp,
                 feels_like=feels_like,
+                dew_point=ParseWeather._calculate_dew_point(temp=temp, humidity=humidity),
                 weather_code=weather_code,
                 weather_description=weather_description,
                 wind_speed=wind_speed,
@@ -74,25 +95,43 @@ class ParseWeather:
                 time=time,
                 sunrise=sunrise,
                 sunset=sunset,
+                utc_offset=raw_data["timezone"],
             )
         except KeyError as ex:
             logger.error("Error when parsing current weather data: %s", ex)
         return None
 
     @staticmethod
-    async def parse_weather_forecast(raw_data: dict, units: str) -> ForecastData | None:
-        """Parses weather forecast data from OpenWeatherAPI response"""
+    async def parse_weather_forecast(raw_data: dict) -> ForecastData | None:
+        """Parses weather forecast data from OpenWeatherAPI response in metric units"""
         time: list[str] = []
         ico_code: list[str] = []
-        temp: list[str] = []
-        wind_speed: list[str] = []
+        temp: array = array("f")
+        wind_speed: array = array("f")
         try:
             for item in raw_data["list"]:
                 time.append(datetime.fromtimestamp(item["dt"]).strftime("%H:%M"))
                 ico_code.append(item["weather"][0]["icon"])
-                temp.append(f"{round(item['main']['temp'])}{'°C' if units == 'metric' else '°F'}")
-                wind_speed.append(f"{round(item['wind']['speed'])} {'m/s' if units == 'metric' else 'mph'}")
+                temp.append(item["main"]["temp"])
+                wind_speed.append(item["wind"]["speed"])
             return ForecastData(time=time, ico_code=ico_code, temp=temp, wind_speed=wind_speed)
         except KeyError as ex:
             logger.error("Error when parsing weather forecast data: %s", ex)
         return None
+
+    async def convert_current_weather(self, weather_data: CurrentWeatherData, units: str) -> CurrentWeatherData:
+        """Converts current weather data to the units of the user, temperatures and speeds are rounded for display"""
+        return weather_data._replace(
+            temp=self._convert_temperature(temp=weather_data.temp, units=units),
+            feels_like=self._convert_temperature(temp=weather_data.feels_like, units=units),
+            dew_point=self._convert_temperature(temp=weather_data.dew_point, units=units),
+            wind_speed=self._convert_speed(speed=weather_data.wind_speed, units=units),
+            gust=self._convert_speed(speed=weather_data.gust, units=units) if weather_data.gust else None,
+        )
+
+    async def convert_weather_forecast(self, data: ForecastData, units: str) -> ForecastData:
+        """Converts weather forecast data to the units of the user, temperatures and speeds are rounded for display"""
+        return data._replace(
+            temp=array("f", (self._convert_temperature(temp=temp, units=units) for temp in data.temp)),
+            wind_speed=array("f", (self._convert_speed(speed=speed, units=units) for speed in data.wind_speed)),
+        )
@@ -0,0 +1,107 @@
+"""Planning of scheduled weather updates within the monthly budget of OpenWeatherMap requests"""
+
+from calendar import monthrange
+from datetime import datetime
+from logging import INFO, WARNING
+from math import ceil
+
+from tgbot.config import QuotaSettings
+from tgbot.misc.logger import logger
+from tgbot.services.classes import RefreshPlan, UserWeatherSettings
+from tgbot.services.database import database
+
+LocationKey = tuple[float, float]  # latitude, longitude
+
+REFRESH_INTERVALS: tuple[int, ...] = (3, 6, 12, 24)  # hours, the plan is revised every 3 hours
+LOCATION_PRECISIONS: tuple[int | None, ...] = (None, 2, 1)  # exact coordinates, about 1 km, about 10 km
+REQUESTS_PER_LOCATION: int = 2  # current weather and weather forecast
+
+
+def get_location_key(settings: UserWeatherSettings, precision: int | None = None) -> LocationKey:
+    """Returns the key of the location, the coordinates are rounded to the specified number of decimal places"""
+    if precision is None:
+        return settings.latitude, settings.longitude
+    return round(settings.latitude, precision), round(settings.longitude, precision)
+
+
+class QuotaGovernor:
+    """Thins out scheduled weather updates so that the requests fit into the monthly budget"""
+
+    def __init__(self, settings: QuotaSettings) -> None:
+        """Creates a governor for the specified budget"""
+        self._settings = settings
+        self._last_plan: RefreshPlan | None = None
+
+    async def plan(self) -> RefreshPlan:
+        """
+        Chooses the most frequent updates with the most exact grouping of users that fit into the budget,
+        part of the budget is left for requests of users in the dialog until the end of the month
+
+        :return: whether to run updates, their interval and the grouping precision
+        """
+        now: datetime = datetime.now()
+        month_hours: int = monthrange(now.year, now.month)[1] * 24
+        month_start: datetime = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        elapsed_hours: float = (now - month_start).total_seconds() / 3600
+        remaining_hours: float = month_hours - elapsed_hours
+        used: int = await database.get_api_counter_value()
+        reserve: int = round(
+            self._settings.monthly_limit * self._settings.interactive_reserve * remaining_hours / month_hours
+        )
+        available: int = self._settings.monthly_limit - used - reserve
+        logger.info(
+            "API budget: %s of %s requests used, %s projected by the end of the month at the current rate",
+            used,
+            self._settings.monthly_limit,
+            round(used * month_hours / elapsed_hours) if elapsed_hours > 1 else used,
+        )
+        locations: dict[int | None, int] = {
+            precision: await database.get_number_of_locations(precision=precision) for precision in LOCATION_PRECISIONS
+        }
+        refresh_plan: RefreshPlan | None = None
+        for interval in REFRESH_INTERVALS:
+            runs: int = ceil(remaining_hours / interval)
+            for precision in LOCATION_PRECISIONS:
+                cost: int = runs * locations[precision] * REQUESTS_PER_LOCATION
+                if cost <= available:
+                    refresh_plan = RefreshPlan(
+                        run=True,
+                        interval=interval,
+                        precision=precision,
+                        locations=locations[precision],
+                        projected=used + cost + reserve,
+                    )
+                    break
+            if refresh_plan:
+                break
+        if refresh_plan is None:  # spend the rest of the budget on daily updates while it lasts
+            precision = LOCATION_PRECISIONS[-1]
+            refresh_plan = RefreshPlan(
+                run=locations[precision] * REQUESTS_PER_LOCATION <= available,
+                interval=REFRESH_INTERVALS[-1],
+                precision=precision,
+                locations=locations[precision],
+                projected=used + locations[precision] * REQUESTS_PER_LOCATION + reserve,
+            )
+        self._log(refresh_plan=refresh_plan)
+        return refresh_plan
+
+    def _log(self, refresh_plan: RefreshPlan) -> None:
+        """Logs the plan, a warning is logged if updates are thinned out or the plan has changed"""
+        throttled: bool = (refresh_plan.interval, refresh_plan.precision) != (
+            REFRESH_INTERVALS[0],
+            LOCATION_PRECISIONS[0],
+        )
+        changed: bool = self._last_plan is not None and (
+            (self._last_plan.interval, self._last_plan.precision) != (refresh_plan.interval, refresh_plan.precision)
+        )
+        logger.log(
+            WARNING if throttled or changed else INFO,
+            "Scheduled updates %s: every %s hours, coordinates %s, %s locations, %s requests projected for the month",
+            "planned" if refresh_plan.run else "stopped",
+            refresh_plan.interval,
+            "exact" if refresh_plan.precision is None else f"rounded to {refresh_plan.precision} decimal places",
+            refresh_plan.locations,
+            refresh_plan.projected,
+        )
+        self._last_plan = refresh_plan
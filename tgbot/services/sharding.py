@@ -0,0 +1,44 @@
+"""Division of scheduled updates between several bot processes"""
+
+from os import getpid
+from secrets import token_hex
+from socket import gethostname
+
+from tgbot.misc.logger import logger
+from tgbot.services.broadcast_store import broadcast_store
+
+
+class ShardLeases:
+    """Shards of users leased by this bot process in the database, each shard is served by one process at a time"""
+
+    def __init__(self) -> None:
+        """Creates a unique identifier of the process"""
+        self._owner: str = f"{gethostname()}:{getpid()}:{token_hex(4)}"
+        self._shards: list[int] = []
+
+    async def claim(self, shards: int, lease_ttl: int) -> dict[int, float]:
+        """Renews and evens out the leases, returns shards and the time until which their updates have been processed"""
+        progress: dict[int, float] = await broadcast_store.claim_shards(
+            owner=self._owner, shards=shards, lease_ttl=lease_ttl
+        )
+        if sorted(progress) != self._shards:
+            self._shards = sorted(progress)
+            logger.info("Shards of scheduled updates leased by %s: %s", self._owner, self._shards)
+        return progress
+
+    async def renew(self, lease_ttl: int) -> None:
+        """Extends the leases, while the process is busy with a long update"""
+        await broadcast_store.renew_shards(owner=self._owner, lease_ttl=lease_ttl)
+
+    async def save_progress(self, shards: list[int], processed_until: float) -> None:
+        """Saves the time until which scheduled updates of the shards have been processed"""
+        await broadcast_store.save_shard_progress(owner=self._owner, shards=shards, processed_until=processed_until)
+
+    async def release(self) -> None:
+        """Releases all leases of the process"""
+        if self._shards:
+            await broadcast_store.release_shards(owner=self._owner)
+            self._shards = []
+
+
+shard_leases: ShardLeases = ShardLeases()
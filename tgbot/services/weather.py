@@ -1,15 +1,27 @@
 """ Classes for getting weather information """
 
+from asyncio import gather, TimeoutError as AsyncioTimeoutError
+
 from aiogram.types import Location
-from aiohttp import ClientSession
+from aiohttp import ClientError
 
-from tgbot.config import load_config, BOT_LOGO
+from tgbot.config import load_config, Config, HttpClientSettings
 from tgbot.middlewares.localization import i18n
 from tgbot.misc.logger import logger
 from tgbot.services.database import database, UserWeatherSettings
-from tgbot.services.classes import CityData, CurrentWeatherData, ForecastData
+from tgbot.services.breaker import CircuitOpenError
+from tgbot.services.cache import ApiCaches, GeocodingCache, SingleFlight, WeatherCache
+from tgbot.services.classes import (
+    CityData,
+    CurrentWeatherData,
+    ForecastData,
+    LocationWeather,
+    WeatherSnapshot,
+)
 from tgbot.services.formatter import FormatWeather
-from tgbot.services.image import DrawWeatherImage
+from tgbot.services.geoindex import OfflineGeocoder
+from tgbot.services.http_client import HttpClient
+from tgbot.services.image import renderer
 from tgbot.services.parser import ParseWeather
 
 _ = i18n.gettext  # Alias for gettext method
@@ -21,26 +33,63 @@ class WeatherAPI:
     _GEOCODING_API_URL: str = "https://api.openweathermap.org/geo/1.0"
     _CURRENT_WEATHER_API_URL: str = "https://api.openweathermap.org/data/2.5/weather"
     _WEATHER_FORECAST_API_URL: str = "https://api.openweathermap.org/data/2.5/forecast"
+    _WEATHER_API_PARAMS: str = "units=metric&lang=en"  # converted and translated for each user by the bot itself
 
-    def __init__(self, token: str) -> None:
-        """Gets OpenWeatherAPI token"""
-        self._api_key = token
+    def __init__(self, config: Config) -> None:
+        """Gets OpenWeatherAPI token and the settings of the city search"""
+        self._api_key = config.weather_api.token
         self._formatter = FormatWeather()
         self._parser = ParseWeather()
-        self._image = DrawWeatherImage()
-
-    @staticmethod
-    async def _get_response_from_api(api_url: str) -> list | dict | None:
-        """Returns the list of found cities"""
-        async with ClientSession() as session:
-            async with session.get(url=api_url) as response:
-                await database.increase_api_counter()
-                if response.status == 200:
-                    result: list | dict = await response.json()
-                    return result
-                error: dict = await response.json()
-                logger.error("Error when requesting WeatherGeocodeAPI: %s", error.get("message"))
-                return None
+        self._http = HttpClient(on_request=database.increase_api_counter)
+        self._caches = ApiCaches(
+            single_flight=SingleFlight(settings=config.coalescing),
+            weather=WeatherCache(settings=config.weather_cache),
+            geocoding=GeocodingCache(settings=config.geocoding_cache),
+        )
+        self._offline_geocoder = OfflineGeocoder(settings=config.offline_geocoding)
+
+    async def open(self, settings: HttpClientSettings) -> None:
+        """Opens the pooled HTTP client and loads the offline city index, if it is enabled"""
+        await self._http.open(settings=settings)
+        await self._offline_geocoder.load()
+
+    async def close(self) -> None:
+        """Logs the statistics and closes the pooled HTTP client"""
+        self.log_stats()
+        await self._http.close()
+
+    def log_stats(self) -> None:
+        """Logs the statistics of the connection pool, the caches and the sharing of identical requests"""
+        logger.info("HTTP connection pool statistics: %s", self._http.stats)
+        logger.info("City search cache statistics: %s", self._caches.geocoding.stats)
+        logger.info("Identical request sharing statistics: %s", self._caches.single_flight.stats)
+        logger.info("Last obtained weather was shown instead of the current one %s times", self._caches.weather.stale)
+
+    async def delete_expired_geocoding_cache(self) -> None:
+        """Deletes expired city search results from the database"""
+        await self._caches.geocoding.delete_expired()
+
+    async def _get_response_from_api(self, api_url: str) -> list | dict | None:
+        """Returns the decoded response of the OpenWeatherMap API, identical requests are made once"""
+        return await self._caches.single_flight.call(
+            key=api_url.removesuffix(f"&appid={self._api_key}"),
+            request=lambda: self._request_api(api_url=api_url),
+        )
+
+    async def _request_api(self, api_url: str) -> list | dict | None:
+        """Requests the OpenWeatherMap API and decodes the response"""
+        try:
+            status, result = await self._http.get_json(url=api_url)
+        except CircuitOpenError:  # the unavailability is logged once by the circuit breaker
+            return None
+        except (ClientError, AsyncioTimeoutError) as ex:  # on Python 3.10 it is not the builtin TimeoutError
+            logger.error("Error when requesting OpenWeatherMap API: %s", repr(ex))
+            return None
+        if status == 200 and isinstance(result, list | dict):
+            return result
+        message: str | int = result.get("message", status) if isinstance(result, dict) else status
+        logger.error("Error when requesting OpenWeatherMap API: %s", message)
+        return None
 
     async def get_list_cities(self, city_name_or_location: str | Location, lang_code: str) -> list[CityData] | None:
         """
@@ -51,84 +100,154 @@ class WeatherAPI:
         :return: list of CityData objects
         """
         if isinstance(city_name_or_location, Location):
+            offline_city_list: list[CityData] | None = self._offline_geocoder.find_cities(
+                latitude=city_name_or_location.latitude,
+                longitude=city_name_or_location.longitude,
+                lang_code=lang_code,
+            )
+            if offline_city_list is not None:
+                return offline_city_list
+            cache_key: str = self._caches.geocoding.get_reverse_key(
+                latitude=city_name_or_location.latitude, longitude=city_name_or_location.longitude, lang_code=lang_code
+            )
             api_url: str = (
                 f"{self._GEOCODING_API_URL}/reverse"
                 f"?lat={city_name_or_location.latitude}&lon={city_name_or_location.longitude}"
                 f"&limit=5&appid={self._api_key}"
             )
         else:
-            api_url = (
-                f"{self._GEOCODING_API_URL}/direct"
-                f"?q={await self._formatter.correct_user_input(city_name=city_name_or_location)}"
-                f"&limit=5&appid={self._api_key}"
-            )
+            city_name: str = await self._formatter.correct_user_input(city_name=city_name_or_location)
+            cache_key = self._caches.geocoding.get_direct_key(city_name=city_name, lang_code=lang_code)
+            api_url = f"{self._GEOCODING_API_URL}/direct?q={city_name}&limit=5&appid={self._api_key}"
+        city_list: list[CityData] | None = await self._caches.geocoding.get(key=cache_key)
+        if city_list is not None:
+            return city_list
         raw_city_data: list | dict | None = await self._get_response_from_api(api_url=api_url)
-        city_list: list[CityData] = []
         if isinstance(raw_city_data, list):
+            city_list = []
             for raw_city in raw_city_data:
                 city: CityData | None = await self._parser.parse_city_data(raw_data=raw_city, lang_code=lang_code)
                 if city:
                     city_list.append(city)
+            await self._caches.geocoding.set(key=cache_key, cities=city_list)
             return city_list
         return None
 
-    async def get_current_weather(self, user_id: int) -> str:
+    async def fetch_current_weather(self, settings: UserWeatherSettings) -> CurrentWeatherData | None:
         """
-        Gets current weather data from the OpenWeatherMap service and outputs them in formatted form
+        Gets current weather data for the location from the user's settings, in metric units and English
 
-        :param user_id: Telegram user ID
-        :return: Formatted string with a description of the current weather or an error message
+        :param settings: user's weather settings
+        :return: parsed current weather data or None in case of error
         """
-        user_settings: UserWeatherSettings = await database.get_user_settings(user_id=user_id)
         api_url: str = (
             f"{self._CURRENT_WEATHER_API_URL}"
-            f"?lat={user_settings.latitude}"
-            f"&lon={user_settings.longitude}"
-            f"&lang={user_settings.lang}"
-            f"&units={user_settings.units}"
+            f"?lat={settings.latitude}"
+            f"&lon={settings.longitude}"
+            f"&{self._WEATHER_API_PARAMS}"
             f"&appid={self._api_key}"
         )
         raw_data: list | dict | None = await self._get_response_from_api(api_url=api_url)
         if isinstance(raw_data, dict):
-            weather_data: CurrentWeatherData | None = await self._parser.parse_current_weather(raw_data=raw_data)
-            if weather_data:
-                current_weather: str = await self._formatter.format_current_weather(
-                    weather_data=weather_data,
-                    units=user_settings.units,
-                    city=user_settings.city,
-                    lang_code=user_settings.lang,
+            return await self._parser.parse_current_weather(raw_data=raw_data)
+        return None
+
+    async def format_current_weather(
+        self, weather_data: CurrentWeatherData | None, settings: UserWeatherSettings, stale: bool = False
+    ) -> str:
+        """
+        Formats current weather data for the user
+
+        :param weather_data: parsed current weather data in metric units or None if it could not be obtained
+        :param settings: user's weather settings
+        :param stale: whether the data is the last obtained one, because OpenWeatherMap is unavailable
+        :return: Formatted string with a description of the current weather or an error message
+        """
+        if weather_data:
+            converted: CurrentWeatherData = await self._parser.convert_current_weather(
+                weather_data=weather_data, units=settings.units
+            )
+            current_weather: str = await self._formatter.format_current_weather(
+                weather_data=converted, units=settings.units, city=settings.city, lang_code=settings.lang
+            )
+            if stale:
+                current_weather += "\n\n⚠️ " + _(
+                    "OpenWeatherMap is unavailable, the weather may be outdated", locale=settings.lang
                 )
-                return current_weather
-        current_weather = "❌ " + _("Failed to obtain data about the current weather", locale=user_settings.lang)
+            return current_weather
+        current_weather = "❌ " + _("Failed to obtain data about the current weather", locale=settings.lang)
         return current_weather
 
-    async def get_weather_forecast(self, user_id: int) -> str:
+    async def fetch_weather_forecast(self, settings: UserWeatherSettings) -> ForecastData | None:
         """
-        Returns the weather forecast data in the desired form
+        Gets the weather forecast for the location from the user's settings, in metric units and English
 
-        :param user_id: Telegram user ID
-        :return: Path to the generated weather forecast image or bot logo in case of error
+        :param settings: user's weather settings
+        :return: parsed weather forecast data or None in case of error
         """
-        user_settings: UserWeatherSettings = await database.get_user_settings(user_id=user_id)
         api_url: str = (
             f"{self._WEATHER_FORECAST_API_URL}"
-            f"?lat={user_settings.latitude}"
-            f"&lon={user_settings.longitude}"
-            f"&lang={user_settings.lang}"
-            f"&units={user_settings.units}"
+            f"?lat={settings.latitude}"
+            f"&lon={settings.longitude}"
+            f"&{self._WEATHER_API_PARAMS}"
             "&cnt=8"
             f"&appid={self._api_key}"
         )
         raw_data: list | dict | None = await self._get_response_from_api(api_url=api_url)
         if isinstance(raw_data, dict):
-            weather_forecast_data: ForecastData | None = await self._parser.parse_weather_forecast(
-                raw_data=raw_data, units=user_settings.units
+            return await self._parser.parse_weather_forecast(raw_data=raw_data)
+        return None
+
+    async def fetch_weather(self, settings: UserWeatherSettings) -> LocationWeather:
+        """
+        Gets the current weather and the weather forecast for the location with concurrent requests,
+        the result only depends on the coordinates and is shared by all users of the location.
+        While OpenWeatherMap is unavailable, the last obtained weather of the location is returned marked as stale
+
+        :param settings: user's weather settings
+        :return: parsed current weather and forecast, each of them is None in case of error
+        """
+
+        async def fetch() -> LocationWeather:
+            current, forecast = await gather(
+                self.fetch_current_weather(settings=settings), self.fetch_weather_forecast(settings=settings)
+            )
+            return LocationWeather(current=current, forecast=forecast)
+
+        return await self._caches.weather.get(
+            key=f"{settings.latitude}:{settings.longitude}",
+            fetch=fetch,
+            available=self._http.is_available(url=self._CURRENT_WEATHER_API_URL)
+            and self._http.is_available(url=self._WEATHER_FORECAST_API_URL),
+        )
+
+    async def get_weather_snapshot(self, user_id: int) -> WeatherSnapshot:
+        """
+        Gets the weather for the location from the user's settings and prepares it for sending
+
+        :param user_id: Telegram user ID
+        :return: caption with the current weather and PNG image of the weather forecast (None in case of error)
+        """
+        user_settings: UserWeatherSettings = await database.get_user_settings(user_id=user_id)
+        location_weather: LocationWeather = await self.fetch_weather(settings=user_settings)
+        if location_weather.current:
+            await database.save_utc_offset(user_ids=[user_id], utc_offset=location_weather.current.utc_offset)
+        forecast_image: bytes | None = (
+            await renderer.draw_image(
+                data=await self._parser.convert_weather_forecast(
+                    data=location_weather.forecast, units=user_settings.units
+                ),
+                units=user_settings.units,
             )
-            if weather_forecast_data:
-                forecast_image: str = self._image.draw_image(data=weather_forecast_data, user_id=user_id)
-                return forecast_image
-        forecast_image = BOT_LOGO
-        return forecast_image
+            if location_weather.forecast
+            else None
+        )
+        return WeatherSnapshot(
+            caption=await self.format_current_weather(
+                weather_data=location_weather.current, settings=user_settings, stale=location_weather.stale
+            ),
+            image=forecast_image,
+        )
 
 
-weather: WeatherAPI = WeatherAPI(token=load_config().weather_api.token)
+weather: WeatherAPI = WeatherAPI(config=load_config())